@@ -0,0 +1,224 @@
+import argparse
+import csv
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import obd
+import pandas as pd
+import sklearn
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src import clustering, make_features, parse_data
+from src.drive_log import DriveLogWriter, EventLogWriter, load_drive_log, load_event_log
+from src.obd_sim import PID_ENCODERS, SimulatedOBD
+from src.pid_scheduler import PIDSchedule, PIDScheduler
+from src.stream_features import StreamingFeatureExtractor
+from src.synthetic import DEFAULT_SEGMENTS, make_synthetic_drive, write_synthetic_drive
+
+SYNTHETIC_RATE = 10.0
+
+
+def synthetic_drive_file(directory: Path, n_rows: int, seed: int) -> Path:
+    """
+    Writes a synthetic drive CSV of about n_rows rows, scaling every default segment by the same amount
+    """
+    total_seconds = sum(seconds for _, seconds in DEFAULT_SEGMENTS)
+    scale = n_rows / (total_seconds * SYNTHETIC_RATE)
+    segments = [(kind, seconds * scale) for kind, seconds in DEFAULT_SEGMENTS]
+    return write_synthetic_drive(directory / f"drive_{n_rows}.csv", segments, rate=SYNTHETIC_RATE, seed=seed)
+
+
+def measure(fn, repeat: int) -> dict:
+    """
+    Best wall time over repeat runs, plus the peak traced allocation of one run
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "peak_bytes": peak}
+
+
+def scaled_features(csv_path: Path, n_rows: int) -> pd.DataFrame:
+    features = make_features.make_features_clustering(make_features.get_data_from_csv(csv_path))
+    features = features.replace([np.inf, -np.inf], np.nan).dropna().iloc[:n_rows]
+    return pd.DataFrame(sklearn.preprocessing.StandardScaler().fit_transform(features), columns=features.columns)
+
+
+def check_streaming(n_rows: int, seed: int, n_repeats: int = 10) -> int:
+    """
+    Feeds a synthetic drive through StreamingFeatureExtractor and make_features_clustering and
+    returns the number of feature cells that disagree. n_repeats random rows re-log the previous
+    row's RPM sample, like a cached response does, so the drive has zero time differences.
+    """
+    total_seconds = sum(seconds for _, seconds in DEFAULT_SEGMENTS)
+    scale = n_rows / (total_seconds * SYNTHETIC_RATE)
+    segments = [(kind, seconds * scale) for kind, seconds in DEFAULT_SEGMENTS]
+    drive = make_synthetic_drive(segments, rate=SYNTHETIC_RATE, seed=seed)
+    rng = np.random.default_rng(seed)
+    for i in rng.choice(np.arange(1, len(drive)), size=min(n_repeats, len(drive) - 1), replace=False):
+        drive.loc[i, ["rpm_time", "rpm_value"]] = drive.loc[i - 1, ["rpm_time", "rpm_value"]].to_numpy()
+
+    batch = make_features.make_features_clustering(make_features.add_derived_columns(drive.copy())).to_numpy()
+    extractor = StreamingFeatureExtractor()
+    stream = np.array([list(extractor.update(row).values()) for row in drive.to_numpy()])
+    # both sides use running sums, so e.g. the std of a flat window after a fast stretch is only 0
+    # to within rounding of the earlier values; compare relative to each feature's scale
+    scale = np.nanmax(np.abs(batch), axis=0, initial=1.0)
+    same = (np.abs(batch - stream) <= 1e-6 * scale) | (np.isnan(batch) & np.isnan(stream))
+    mismatches = int((~same).sum())
+    print(f"streaming vs. batch features: {mismatches} of {same.size} cells differ", file=sys.stderr)
+    return mismatches
+
+
+def check_event_log(n_polls: int, seed: int, null_rate: float = 0.05, max_queries: int = None) -> int:
+    """
+    Polls a simulated ELM327 that sometimes doesn't answer, logs every poll both as a dense row and
+    as the events actually received, and returns the number of cells where load_event_log's
+    rebuilt frame differs from the dense log. With max_queries, the scheduler has a query budget.
+    """
+    # half the PIDs every cycle, the other half every few milliseconds so some polls skip them
+    schedules = [PIDSchedule(getattr(obd.commands, name), interval=0.0 if i < 5 else 0.002)
+                 for i, name in enumerate(PID_ENCODERS)]
+    scheduler = PIDScheduler(SimulatedOBD(latency=0.0002, null_rate=null_rate, seed=seed), schedules,
+                             max_queries=max_queries)
+    with tempfile.TemporaryDirectory(prefix="check-") as tmp_dir:
+        dense_path = Path(tmp_dir) / "drive.dlog"
+        events_path = Path(tmp_dir) / "drive.elog"
+        with DriveLogWriter(dense_path) as dense, EventLogWriter(events_path) as events:
+            for _ in range(n_polls):
+                responses = scheduler.poll()
+                values = [r.value.magnitude if r.value is not None else np.nan for r in responses]
+                dense.append([x for r, v in zip(responses, values) for x in (r.time, v)])
+                events.append_events([(i, r.time, v) for i, (s, r, v) in enumerate(zip(schedules, responses, values))
+                                      if s.command.name in scheduler.queried | scheduler.skipped])
+        expected = load_drive_log(dense_path).to_numpy()
+        time_steps = np.diff(expected[:, 0])
+        rebuilt = load_event_log(events_path).to_numpy()
+
+    if rebuilt.shape != expected.shape:
+        print(f"event log round trip: {len(rebuilt)} rows rebuilt from {len(expected)} polls", file=sys.stderr)
+        return max(expected.size, 1)
+    same = (rebuilt == expected) | (np.isnan(rebuilt) & np.isnan(expected))
+    mismatches = int((~same).sum())
+    # every-cycle PIDs (the RPM time base among them) must never repeat a timestamp
+    repeats = int((time_steps == 0).sum())
+    print(f"event log round trip (max_queries={max_queries}): {mismatches} of {same.size} cells differ "
+          f"({int(np.isnan(expected[:, 1::2]).sum())} null readings), {repeats} repeated rpm_time", file=sys.stderr)
+    return mismatches + repeats
+
+
+def run_benchmarks(sizes, cluster_sizes, repeat: int, seed: int) -> list:
+    results = []
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        for n_rows in sorted(set(sizes) | set(cluster_sizes)):
+            csv_path = synthetic_drive_file(tmp_dir, n_rows, seed)
+            benches = dict()
+
+            if n_rows in sizes:
+                with csv_path.open("r", newline="") as f:
+                    rows = list(csv.reader(f))
+                df = make_features.get_data_from_csv(csv_path)
+                benches["parse_row"] = lambda: [parse_data.parse_row(row) for row in rows]
+                benches["parse_csv"] = lambda: parse_data.parse_csv(csv_path)
+                benches["get_data_from_csv"] = lambda: make_features.get_data_from_csv(csv_path)
+                benches["make_features_clustering"] = lambda: make_features.make_features_clustering(df)
+
+            if n_rows in cluster_sizes:
+                x = scaled_features(csv_path, n_rows)
+                kmeans_models = clustering.run_kmeans_jobs(x, random_state=seed, n_init=1)
+                benches["run_kmeans_jobs"] = lambda: clustering.run_kmeans_jobs(x, random_state=seed, n_init=1)
+                benches["run_DBSCAN_jobs"] = lambda: clustering.run_DBSCAN_jobs(x, eps_min=1.0, eps_max=1.5, min_samples_max=6)
+                benches["get_silh_scores"] = lambda: clustering.get_silh_scores(x, kmeans_models)
+
+            for name, fn in benches.items():
+                r = measure(fn, repeat)
+                results.append({"name": name, "size": n_rows, **r})
+                print(f"{name:>26} {n_rows:>9} {r['seconds']:>10.4f}s {r['peak_bytes'] / 2**20:>10.1f} MiB", file=sys.stderr)
+    return results
+
+
+def compare(results: list, baseline: dict, tolerance: float, min_seconds: float = 0.0) -> list:
+    """
+    Returns the results that got slower than baseline by more than tolerance (a fraction).
+    Benchmarks faster than min_seconds in both runs are too noisy to count.
+    """
+    base = {(r["name"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = base.get((r["name"], r["size"]))
+        if b is None:
+            continue
+        ratio = r["seconds"] / b["seconds"] if b["seconds"] > 0 else float("inf")
+        noisy = max(r["seconds"], b["seconds"]) < min_seconds
+        status = "REGRESSION" if ratio > 1 + tolerance and not noisy else "ok"
+        print(f"{r['name']:>26} {r['size']:>9} {b['seconds']:>10.4f}s -> {r['seconds']:>10.4f}s ({ratio:.2f}x) {status}", file=sys.stderr)
+        if status != "ok":
+            regressions.append({**r, "baseline_seconds": b["seconds"], "ratio": ratio})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            prog="benchmark",
+            description="Times the parsing, feature and clustering functions on synthetic drives",
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="drive lengths in rows for the parsing and feature benchmarks")
+    parser.add_argument("--cluster-sizes", type=int, nargs="+", default=[1000, 5000],
+                        help="feature rows for the clustering and scoring benchmarks")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output-file", help="write the results as JSON here")
+    parser.add_argument("--baseline", help="JSON results from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown vs. the baseline, as a fraction, before it counts as a regression")
+    parser.add_argument("--min-seconds", type=float, default=0.01,
+                        help="benchmarks faster than this in both runs never count as regressions")
+    parser.add_argument("--skip-checks", action="store_true",
+                        help="don't check that the streaming features match the batch features "
+                             "and that event logs round trip first")
+    args = parser.parse_args()
+
+    if not args.skip_checks and (check_streaming(3000, args.seed) or check_event_log(200, args.seed)
+                                or check_event_log(200, args.seed, max_queries=3)):
+        sys.exit(1)
+
+    output = {
+        "meta": {
+            "time": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__,
+        },
+        "results": run_benchmarks(args.sizes, args.cluster_sizes, args.repeat, args.seed),
+    }
+
+    if args.output_file:
+        with open(args.output_file, "w") as f:
+            json.dump(output, f, indent=1)
+    else:
+        json.dump(output, sys.stdout, indent=1)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(output["results"], json.load(f), args.tolerance, args.min_seconds)
+        if regressions:
+            sys.exit(1)
@@ -1,101 +1,70 @@
 import obd
 import time
-import csv
 import math
 import statistics
-import pint
-from collections import deque
-
-DRIVE_FILE = "drive_" + str(int(time.time())) + ".csv"
+import sys
+from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src.drive_log import DriveLogWriter, EventLogWriter, DRIVE_LOG_SUFFIX, EVENT_LOG_SUFFIX
+from src.pid_scheduler import PIDSchedule, PIDScheduler
+from src.obd_sim import SimulatedOBD
+from src.log_writer import BufferedLogWriter, CSVRowSink
+from src.obd_metrics import PollMetrics, MetricsFileWriter
 
-class Mag:
-    def __init__(self, mag):
-        self.magnitude = mag
-class Coolant:
-    def __init__(self, value: Mag):
-        self.value = value
-        self.time = time.time()
+DRIVE_FILE = "drive_" + str(int(time.time())) + ".csv"
+DRIVE_FORMAT = "csv"
+SIMULATE = False
+WRITER_OPTS = dict()
+METRICS_FILE = None
+METRICS_INTERVAL = 10.0
+MAX_QUERIES = None
 
 
 COOLANT_OP_TEMP_L = 82.0
 COOLANT_OP_TEMP_U = 87.0
-COOLANT_WINDOW_SZ = 25
-COOLANT_POLL_DELAY = 30
-g_coolant_poll_delay_ct = COOLANT_POLL_DELAY
-g_coolant_window = deque(maxlen=COOLANT_WINDOW_SZ)
-g_coolant_at_op_temp = False
-
-INTAKE_POLL_DELAY = 40
-INTAKE_WINDOW_SZ = 30
-g_intake_window = deque(maxlen=INTAKE_WINDOW_SZ)
-g_intake_poll_delay_ct = INTAKE_POLL_DELAY
-
-g_ureg = pint.UnitRegistry()
-
-def get_coolant_temp():
-    global g_coolant_poll_delay_ct
-    global g_coolant_window
-    global obd_conn
-    global g_ureg
-    global g_coolant_at_op_temp
-    global obd_conn
-
-
-    if len(g_coolant_window) < 1:
-        coolant_temp = obd_conn.query(obd.commands.COOLANT_TEMP)
-        g_coolant_window.append(coolant_temp.value.magnitude)
-        return coolant_temp
-
-    # if the last poll was outside of the known operating range,
-    # then keep polling it until it gets within the operating range
-    if g_coolant_window[-1] < COOLANT_OP_TEMP_L or g_coolant_window[-1] > COOLANT_OP_TEMP_U:
-        g_coolant_at_op_temp = False
-        coolant_temp = obd_conn.query(obd.commands.COOLANT_TEMP)
-        g_coolant_window.append(coolant_temp.value.magnitude)
-        return coolant_temp
-
-    g_coolant_at_op_temp = True
-    if g_coolant_poll_delay_ct > 0:
-        g_coolant_poll_delay_ct -= 1
-        r = obd.OBDResponse(obd.commands.COOLANT_TEMP)
-        r.value = pint.Quantity(g_coolant_window[-1], g_ureg.celsius)
-        return r
-    else:
-        g_coolant_poll_delay_ct = COOLANT_POLL_DELAY
-        coolant_temp = obd_conn.query(obd.commands.COOLANT_TEMP)
-        g_coolant_window.append(coolant_temp.value.magnitude)
-        return coolant_temp
-    
-
-def get_intake_temp():
-    global g_coolant_at_op_temp
-    global g_intake_window
-    global g_intake_poll_delay_ct
-    global obd_conn
-
-    if len(g_intake_window) < 1:
-        g_intake_window.append(obd_conn.query(obd.commands.INTAKE_TEMP))
-        return g_intake_window[-1]
-
-    if not g_coolant_at_op_temp:
-        g_intake_window.append(obd_conn.query(obd.commands.INTAKE_TEMP))
-        return g_intake_window[-1]
-    
-    if g_intake_poll_delay_ct > 0:
-        g_intake_poll_delay_ct -= 1
-        r = obd.OBDResponse(obd.commands.INTAKE_TEMP)
-        r.value = g_intake_window[-1].value
-        return r
-    else:
-        g_intake_poll_delay_ct = INTAKE_POLL_DELAY
-        g_intake_window.append(obd_conn.query(obd.commands.INTAKE_TEMP))
-        return g_intake_window[-1]
+# Seconds between queries of the slow PIDs once the engine is warm. These replace the old
+# 30/40 sample poll delays, which came to about this much time at the serial polling rate
+COOLANT_POLL_INTERVAL = 15.0
+INTAKE_POLL_INTERVAL = 20.0
+LONG_FUEL_TRIM_POLL_INTERVAL = 5.0
+
+def coolant_interval(scheduler: PIDScheduler) -> float:
+    # keep polling the coolant temp until it gets within the operating range
+    if scheduler.in_range(obd.commands.COOLANT_TEMP, COOLANT_OP_TEMP_L, COOLANT_OP_TEMP_U):
+        return COOLANT_POLL_INTERVAL
+    return 0.0
+
+def intake_interval(scheduler: PIDScheduler) -> float:
+    # the intake temp moves around while the engine warms up, so poll it until the coolant is warm
+    if scheduler.in_range(obd.commands.COOLANT_TEMP, COOLANT_OP_TEMP_L, COOLANT_OP_TEMP_U):
+        return INTAKE_POLL_INTERVAL
+    return 0.0
+
+# In KNOWN_COL_NAMES / CSV column order
+PID_SCHEDULES = [
+    PIDSchedule(obd.commands.RPM, priority=2),
+    PIDSchedule(obd.commands.SPEED, priority=2),
+    PIDSchedule(obd.commands.MAF, priority=1),
+    PIDSchedule(obd.commands.THROTTLE_POS, priority=2),
+    PIDSchedule(obd.commands.ENGINE_LOAD, priority=1),
+    PIDSchedule(obd.commands.COOLANT_TEMP, interval=coolant_interval),
+    PIDSchedule(obd.commands.SHORT_FUEL_TRIM_1),
+    PIDSchedule(obd.commands.LONG_FUEL_TRIM_1, interval=LONG_FUEL_TRIM_POLL_INTERVAL),
+    PIDSchedule(obd.commands.TIMING_ADVANCE, priority=1),
+    PIDSchedule(obd.commands.INTAKE_TEMP, interval=intake_interval),
+]
 
 def parse_opts():
     import argparse
     from pathlib import Path
     global DRIVE_FILE
+    global DRIVE_FORMAT
+    global SIMULATE
+    global WRITER_OPTS
+    global METRICS_FILE
+    global METRICS_INTERVAL
+    global MAX_QUERIES
     parser = argparse.ArgumentParser(
             prog="Get OBDII PID values",
             description="Polls OBDII PIDs for an ELM327 OBDII scanner",
@@ -103,6 +72,44 @@ def parse_opts():
     parser.add_argument(
             "-o", "--output-file", nargs=1,
     )
+    parser.add_argument(
+            "-f", "--format", choices=["csv", "dlog", "elog"], default="csv",
+            help="csv for text rows, dlog for the binary drive log format, "
+                 "elog for a binary log of only the PID responses actually received",
+    )
+    parser.add_argument(
+            "--simulate", action="store_true",
+            help="poll a simulated ELM327 instead of /dev/ttyUSB0",
+    )
+    parser.add_argument(
+            "--max-queries", type=int,
+            help="PIDs queried per poll at most, picked by how overdue they are weighted by priority; "
+                 "PIDs due every poll that don't fit are logged as null for that poll. No limit by default",
+    )
+    parser.add_argument(
+            "--queue-size", type=int, default=4096,
+            help="rows buffered for the writer thread before new rows get dropped",
+    )
+    parser.add_argument(
+            "--flush-interval", type=float, default=1.0,
+            help="seconds between flushes of the output file",
+    )
+    parser.add_argument(
+            "--fsync-interval", type=float, default=10.0,
+            help="seconds between fsyncs of the output file, 0 to only fsync on exit",
+    )
+    parser.add_argument(
+            "--console-interval", type=float, default=1.0,
+            help="seconds between printing the latest row, 0 to not print rows",
+    )
+    parser.add_argument(
+            "--metrics-file",
+            help="where to write the polling metrics JSON, defaults to the drive file + .metrics.json",
+    )
+    parser.add_argument(
+            "--metrics-interval", type=float, default=10.0,
+            help="seconds between metrics file updates",
+    )
 
     args = parser.parse_args()
     if isinstance(args.output_file, str):
@@ -119,31 +126,41 @@ def parse_opts():
     else:
         pass # DRIVE_FILE is already set by default at runtime
 
-def poll_obd(obd_conn):
-    RPM = obd_conn.query(obd.commands.RPM)
-    speed = obd_conn.query(obd.commands.SPEED)
-    maf = obd_conn.query(obd.commands.MAF)
-    throttle_pos = obd_conn.query(obd.commands.THROTTLE_POS)
-    engine_load = obd_conn.query(obd.commands.ENGINE_LOAD)
-    coolant_temp = get_coolant_temp()
-    s_fuel_trim = obd_conn.query(obd.commands.SHORT_FUEL_TRIM_1)
-    l_fuel_trim = obd_conn.query(obd.commands.LONG_FUEL_TRIM_1)
-    timing_advance = obd_conn.query(obd.commands.TIMING_ADVANCE)
-    intake_temp = get_intake_temp()
-    data = [
-            RPM.time, RPM.value.magnitude,
-            speed.time, speed.value.magnitude,
-            maf.time, maf.value.magnitude,
-            throttle_pos.time, throttle_pos.value.magnitude,
-            engine_load.time, engine_load.value.magnitude,
-            coolant_temp.time, coolant_temp.value.magnitude,
-            s_fuel_trim.time, s_fuel_trim.value.magnitude,
-            l_fuel_trim.time, l_fuel_trim.value.magnitude,
-            timing_advance.time, timing_advance.value.magnitude,
-            intake_temp.time, intake_temp.value.magnitude
-    ]
+    DRIVE_FORMAT = args.format
+    SIMULATE = args.simulate
+    METRICS_INTERVAL = args.metrics_interval
+    MAX_QUERIES = args.max_queries
+    WRITER_OPTS = dict(
+            maxsize=args.queue_size,
+            flush_interval=args.flush_interval,
+            fsync_interval=args.fsync_interval if args.fsync_interval > 0 else None,
+            console_interval=args.console_interval if args.console_interval > 0 else None,
+    )
+    if DRIVE_FORMAT == "dlog" and not isinstance(args.output_file, str):
+        DRIVE_FILE = str(Path(DRIVE_FILE).with_suffix(DRIVE_LOG_SUFFIX))
+    elif DRIVE_FORMAT == "elog" and not isinstance(args.output_file, str):
+        DRIVE_FILE = str(Path(DRIVE_FILE).with_suffix(EVENT_LOG_SUFFIX))
+    # after the suffix is final, so the sidecar is named after the file actually written
+    METRICS_FILE = args.metrics_file if args.metrics_file else str(DRIVE_FILE) + ".metrics.json"
+
+def poll_obd(scheduler: PIDScheduler) -> list:
+    data = []
+    for r in scheduler.poll():
+        data += [r.time, r.value.magnitude if r.value is not None else math.nan]
     return data
 
+def poll_obd_events(scheduler: PIDScheduler) -> list:
+    """
+    Polls once, returning (sensor index, time, value) events for only the PIDs that were queried,
+    or skipped and logged as null
+    """
+    events = []
+    for i, r in enumerate(scheduler.poll()):
+        name = scheduler.schedules[i].command.name
+        if name in scheduler.queried or name in scheduler.skipped:
+            events.append((i, r.time, r.value.magnitude if r.value is not None else math.nan))
+    return events
+
 # I'm considering making a pull request so that the OBD object
 # can reconnect after it loses/can't get a connection
 def connect(self, portstr=None, baudrate=None, protocol=None,
@@ -158,16 +175,43 @@ obd.OBD.connect = connect
 
 if __name__ == "__main__":
     parse_opts()
-    obd_conn = obd.OBD("/dev/ttyUSB0", baudrate=115200) # TODO: add a cmdline option for the OBD device string & baudrate
+    if SIMULATE:
+        obd_conn = SimulatedOBD()
+    else:
+        obd_conn = obd.OBD("/dev/ttyUSB0", baudrate=115200) # TODO: add a cmdline option for the OBD device string & baudrate
     timeout = 1
     while not obd_conn.is_connected():
         print("Could not connect to OBD device. Sleeping...")
         time.sleep(timeout)
         obd_conn.connect("/dev/ttyUSB0", baudrate=115200)
+    metrics = PollMetrics()
+    scheduler = PIDScheduler(obd_conn, PID_SCHEDULES, max_queries=MAX_QUERIES, metrics=metrics)
+
+    poll = poll_obd
+    if DRIVE_FORMAT == "dlog":
+        sink = DriveLogWriter(DRIVE_FILE)
+    elif DRIVE_FORMAT == "elog":
+        sink = EventLogWriter(DRIVE_FILE)
+        poll = poll_obd_events
+    else:
+        sink = CSVRowSink(open(DRIVE_FILE, 'w', newline=''))
 
-    with open(DRIVE_FILE, 'w', newline='') as outfile:
-        writer = csv.writer(outfile, delimiter=',',)
+    # the writer threads do all the file & console I/O so it can't stall the next poll;
+    # the poll thread only takes the metrics snapshots
+    writer = BufferedLogWriter(sink, **WRITER_OPTS)
+    metrics_writer = MetricsFileWriter(METRICS_FILE)
+    try:
         while True:
-            data = poll_obd(obd_conn)
-            print(data)
-            writer.writerow(data)
+            writer.submit(poll(scheduler))
+            snapshot = metrics.maybe_snapshot(METRICS_INTERVAL, writer=writer.stats())
+            if snapshot is not None:
+                metrics_writer.submit(snapshot)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        sink.close()
+        metrics_writer.submit(metrics.take_snapshot(writer=writer.stats()))
+        metrics_writer.close()
+        print(metrics.summary())
+        print(f"Log writer: {writer.stats()}")
@@ -1,29 +1,103 @@
 import pandas as pd
 import numpy as np
-from typing import List, Tuple
+import os
+import tempfile
+from typing import Callable, Iterable, List, Tuple
 import sklearn
 
-def run_kmeans_jobs(x_features: pd.DataFrame, *, min_clusters=4, max_clusters=8, **kwargs) -> List[Tuple[sklearn.cluster.KMeans, np.ndarray]]:
+def _fit_predict(model, x_features):
+    labels = model.fit_predict(x_features)
+    return tuple([model, labels])
+
+def _run_fit_jobs(models, x_features, n_workers=None) -> list:
+    """
+    Fits every model on x_features, returning (model, labels) tuples in the same order.
+    With n_workers, fits run in a process pool that shares x_features through a read-only memory map.
+    """
+    if n_workers is None or n_workers == 1:
+        return [_fit_predict(model, x_features) for model in models]
+
+    import joblib
+    with tempfile.TemporaryDirectory(prefix="clustering-") as tmp_dir:
+        # dump the features once; workers get a handle to the memory map instead of a pickled copy
+        path = os.path.join(tmp_dir, "x_features.joblib")
+        joblib.dump(x_features, path)
+        x_shared = joblib.load(path, mmap_mode="r")
+        return joblib.Parallel(n_jobs=n_workers)(
+            joblib.delayed(_fit_predict)(model, x_shared) for model in models
+        )
+
+def run_kmeans_jobs(x_features: pd.DataFrame, *, min_clusters=4, max_clusters=8, n_workers=None, **kwargs) -> List[Tuple[sklearn.cluster.KMeans, np.ndarray]]:
     """
     Train several kmeans jobs, each on the same set of data, incrementing in cluster sizes. 
+    n_workers > 1 (or -1 for all cores) runs the fits in parallel processes.
     """
     if max_clusters < min_clusters:
         raise ValueError(f"Argument 'max_clusters' (got {max_clusters}) must be larger or equal to 'min_clusters' (got {min_clusters})")
 
-    results = []
+    models = []
     for n in range(min_clusters, max_clusters + 1):
         kmeans = sklearn.cluster.KMeans(
                                     n_clusters=n,
                                     **kwargs
                                 )
-        labels = kmeans.fit_predict(x_features)
-        results.append(tuple([kmeans, labels]))
+        models.append(kmeans)
+
+    return _run_fit_jobs(models, x_features, n_workers)
+
+def fit_incremental_scaler(chunks: Iterable[pd.DataFrame]) -> sklearn.preprocessing.StandardScaler:
+    """
+    Fits a StandardScaler one chunk at a time
+    """
+    scaler = sklearn.preprocessing.StandardScaler()
+    for chunk in chunks:
+        scaler.partial_fit(chunk)
+    return scaler
 
-    return results
+def run_minibatch_kmeans_jobs(get_chunks: Callable[[], Iterable[pd.DataFrame]], *, min_clusters=4, max_clusters=8, scale=True, n_epochs=1, **kwargs) -> Tuple[sklearn.preprocessing.StandardScaler, List[sklearn.cluster.MiniBatchKMeans]]:
+    """
+    Out-of-core version of run_kmeans_jobs. get_chunks is called once per pass over the data and should
+    return a fresh iterable of feature chunks, e.g. lambda: make_features.iter_feature_chunks(paths).
+    Every chunk is fed to all cluster counts' MiniBatchKMeans.partial_fit before the next one is read, so
+    peak memory is set by how get_chunks reads the data: iter_feature_chunks reads drives in blocks, but
+    featurizes aligned drives and drives missing from its cache whole. With scale, a first pass fits a StandardScaler incrementally
+    and every chunk is scaled with it. Returns (scaler or None, models).
+    """
+    if max_clusters < min_clusters:
+        raise ValueError(f"Argument 'max_clusters' (got {max_clusters}) must be larger or equal to 'min_clusters' (got {min_clusters})")
+    if n_epochs <= 0:
+        raise ValueError(f"Argument 'n_epochs' (got {n_epochs}) cannot be negative or 0!")
+
+    scaler = fit_incremental_scaler(get_chunks()) if scale else None
+    models = [sklearn.cluster.MiniBatchKMeans(n_clusters=n, **kwargs) for n in range(min_clusters, max_clusters + 1)]
 
-def run_DBSCAN_jobs(x_features: pd.DataFrame, *, eps_min=1.0, eps_max=2.5, eps_step=0.1, eps_correction=10e-6, min_samples_min=5, min_samples_max=8, **kwargs):
+    pending = []
+    for _ in range(n_epochs):
+        for chunk in get_chunks():
+            x = scaler.transform(chunk) if scale else np.asarray(chunk)
+            # partial_fit needs at least n_clusters samples on its first call
+            if pending is not None:
+                pending.append(x)
+                if sum(len(p) for p in pending) < max_clusters:
+                    continue
+                x = np.concatenate(pending)
+                pending = None
+            for kmeans in models:
+                kmeans.partial_fit(x)
+
+    if pending is not None:
+        raise ValueError(f"The chunks hold fewer samples than 'max_clusters' (got {max_clusters})")
+
+    return scaler, models
+
+def run_DBSCAN_jobs(x_features: pd.DataFrame, *, eps_min=1.0, eps_max=2.5, eps_step=0.1, eps_correction=10e-6, min_samples_min=5, min_samples_max=8, n_workers=None, precompute_neighbors=True, **kwargs):
     """
     Runs multiple DBSCAN jobs on a set of data. The return matrix can be quite large.
+    n_workers > 1 (or -1 for all cores) runs the fits in parallel processes.
+
+    With precompute_neighbors, the radius neighbors graph is built once at eps_max (+ eps_correction)
+    and every job is fit on it with metric="precomputed", so the neighbor search is paid once per sweep.
+    The fitted models then hold graph rows in components_; use core_sample_indices_ to index x_features.
     """
     if eps_max <= 0:
         raise ValueError(
@@ -54,25 +128,126 @@ def run_DBSCAN_jobs(x_features: pd.DataFrame, *, eps_min=1.0, eps_max=2.5, eps_s
                 f"Argument 'min_samples_max' (got {min_samples_max}) cannot be smaller than or equal to 'min_samples_min' (got {min_samples_min})"
         )
 
-    results = []
+    if precompute_neighbors and kwargs.get("metric") != "precomputed":
+        nn_kwargs = dict()
+        for key in ("metric", "metric_params", "algorithm", "leaf_size", "p", "n_jobs"):
+            if key in kwargs:
+                nn_kwargs[key] = kwargs.pop(key)
+        nn = sklearn.neighbors.NearestNeighbors(radius=eps_max + eps_correction, **nn_kwargs)
+        nn.fit(x_features)
+        # passing X back in keeps each point as its own (distance 0) neighbor, like DBSCAN counts it
+        x_features = nn.radius_neighbors_graph(x_features, mode="distance", sort_results=True)
+        kwargs["metric"] = "precomputed"
+
+    models = []
     n_eps = int((eps_max - eps_min) / eps_step) + 1
     for min_samples in range(min_samples_min, min_samples_max + 1):
         for eps in np.linspace(eps_min, eps_max, num=n_eps):
             db = sklearn.cluster.DBSCAN(eps=eps, min_samples=min_samples, **kwargs)
-            labels = db.fit_predict(x_features)
-            results.append(tuple([db, labels]))
+            models.append(db)
 
-    return results
+    return _run_fit_jobs(models, x_features, n_workers)
 
-def get_silh_scores(x_features, models, **kwargs):
+def _check_number_of_labels(n_labels, n_samples):
+    if not 1 < n_labels < n_samples:
+        raise ValueError(f"Number of labels is {n_labels}. Valid values are 2 to n_samples - 1 (inclusive)")
+
+def stratified_sample_indices(n_samples: int, sample_size: int, *, n_strata=10, random_state=None) -> np.ndarray:
     """
-    Helper Function to compute all silhouette scores of a model's labels
+    Picks sample_size row indices spread over n_strata contiguous blocks of rows, in proportion to
+    block size. Feature windows are in time order, so every part of a drive ends up represented.
+    """
+    if not 0 < sample_size <= n_samples:
+        raise ValueError(f"Argument 'sample_size' (got {sample_size}) must be between 1 and the number of samples ({n_samples})")
+    if n_strata <= 0:
+        raise ValueError(f"Argument 'n_strata' (got {n_strata}) cannot be negative or 0!")
+
+    rng = sklearn.utils.check_random_state(random_state)
+    bounds = np.linspace(0, n_samples, num=min(n_strata, sample_size) + 1).astype(int)
+    sizes = np.diff(bounds)
+    counts = sizes * sample_size // n_samples
+    # hand out the rounding remainder to the strata that lost the most
+    remainder = sample_size - counts.sum()
+    if remainder > 0:
+        counts[np.argsort(counts - sizes * sample_size / n_samples)[:remainder]] += 1
+
+    picked = [start + rng.choice(size, count, replace=False) for start, size, count in zip(bounds[:-1], sizes, counts)]
+    return np.sort(np.concatenate(picked))
+
+def get_cluster_scores(x_features, models, *, metric="euclidean", sample_size=None, n_strata=10, random_state=None,
+                       calinski_harabasz=True, raw_features=None, working_memory=None, n_jobs=None, **kwds) -> dict:
+    """
+    Scores every model's labels in one pass, returning {model: {"silhouette": ..., "calinski_harabasz": ...}}
+
+    Pairwise distances are computed once, in chunks of rows bounded by working_memory (MiB, sklearn's
+    default if None), and every model's silhouette is accumulated from each chunk before it's dropped.
+    With sample_size, the silhouette is computed on the same stratified sample for every model,
+    while the Calinski-Harabasz score is always computed on all rows, since it's cheap.
+    n_jobs parallelises the distance computation.
+
+    The Calinski-Harabasz score needs feature vectors, so with metric="precomputed" it's computed
+    on raw_features (the rows the distance matrix was built from) if given, and is None otherwise.
     """
+    if metric != "precomputed":
+        raw_features = x_features
+    x = x_features if metric == "precomputed" else np.asarray(x_features)
+    n_samples = x.shape[0]
+    idx = None
+    if sample_size is not None:
+        idx = stratified_sample_indices(n_samples, sample_size, n_strata=n_strata, random_state=random_state)
+        x = x[np.ix_(idx, idx)] if metric == "precomputed" else x[idx]
+        n_samples = len(idx)
+
+    encoded = []
+    for model, labels in models:
+        labels = np.asarray(labels) if idx is None else np.asarray(labels)[idx]
+        _, labels, counts = np.unique(labels, return_inverse=True, return_counts=True)
+        _check_number_of_labels(len(counts), n_samples)
+        encoded.append((labels, counts))
+
+    silh_sums = np.zeros(len(encoded))
+    start = 0
+    for dist_chunk in sklearn.metrics.pairwise_distances_chunked(
+                                    x, metric=metric, working_memory=working_memory, n_jobs=n_jobs, **kwds):
+        dist_chunk = np.asarray(dist_chunk.todense()) if hasattr(dist_chunk, "todense") else dist_chunk
+        chunk_len = dist_chunk.shape[0]
+        rows = np.arange(chunk_len)
+        for i, (labels, counts) in enumerate(encoded):
+            n_labels = len(counts)
+            own = labels[start:start + chunk_len]
+            # per row, the summed distance to the members of each cluster
+            offsets = (rows * n_labels)[:, None] + labels[None, :]
+            clust_dists = np.bincount(offsets.ravel(), weights=dist_chunk.ravel(),
+                                      minlength=chunk_len * n_labels).reshape(chunk_len, n_labels)
+
+            own_sizes = counts[own] - 1
+            with np.errstate(divide="ignore", invalid="ignore"):
+                intra = clust_dists[rows, own] / own_sizes
+                clust_dists[rows, own] = np.inf
+                inter = (clust_dists / counts).min(axis=1)
+                silh = (inter - intra) / np.maximum(intra, inter)
+            # silhouette is 0 for samples in single member clusters
+            silh = np.nan_to_num(np.where(own_sizes > 0, silh, 0))
+            silh_sums[i] += silh.sum()
+        start += chunk_len
+
     scores = dict()
-    for model, labels in models: # This is pretty slow, so I might see about multithreading this/using joblib in the future
-        scores[model] = sklearn.metrics.silhouette_score(x_features, labels, **kwargs)
+    for (model, labels), silh_sum in zip(models, silh_sums):
+        scores[model] = {"silhouette": float(silh_sum / n_samples)}
+        if calinski_harabasz:
+            scores[model]["calinski_harabasz"] = (
+                sklearn.metrics.calinski_harabasz_score(raw_features, labels) if raw_features is not None else None
+            )
     return scores
 
+def get_silh_scores(x_features, models, **kwargs):
+    """
+    Helper Function to compute all silhouette scores of a model's labels
+    Takes the get_cluster_scores keyword arguments, so the distances are only computed once for all models.
+    """
+    scores = get_cluster_scores(x_features, models, calinski_harabasz=False, **kwargs)
+    return {model: score["silhouette"] for model, score in scores.items()}
+
 def get_calinsky_harabasz_scores(x_features, models):
     scores = dict()
     for model, labels in models:
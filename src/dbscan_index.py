@@ -0,0 +1,122 @@
+import os
+import pickle
+import numpy as np
+import sklearn.neighbors
+from pathlib import Path
+from typing import Sequence
+
+INDEX_FORMAT = "driving-classifier/dbscan-index"
+INDEX_VERSION = 1
+
+
+class DBSCANIndex:
+    """
+    Labels new points against a fitted DBSCAN model: a point within eps of a core sample gets the
+    label of the nearest one, anything else is noise (-1), like a border point vs. noise in the fit.
+    The core samples sit in a KD-tree (a ball tree for metrics the KD-tree doesn't support), so each
+    query is O(log n) in the number of core samples. With scaler parameters, new points are scaled
+    the same way the fitted features were before querying.
+    """
+    def __init__(self, core_points, core_labels, eps: float, *, metric: str = "euclidean",
+                 feature_names: Sequence[str] = None, mean=None, scale=None, leaf_size: int = 40, tree=None):
+        self.core_points = np.asarray(core_points, dtype=np.float64)
+        self.core_labels = np.asarray(core_labels)
+        if len(self.core_points) != len(self.core_labels):
+            raise ValueError(f"Got {len(self.core_points)} core points but {len(self.core_labels)} core labels")
+        if len(self.core_points) == 0:
+            raise ValueError("The model has no core samples, every point would be noise")
+        if eps <= 0:
+            raise ValueError(f"Argument 'eps' (got {eps}) cannot be negative or 0!")
+        self.eps = float(eps)
+        self.metric = metric
+        self.feature_names = list(feature_names) if feature_names is not None else None
+        n_features = self.core_points.shape[1]
+        self.mean = np.zeros(n_features) if mean is None else np.asarray(mean, dtype=np.float64)
+        self.scale = np.ones(n_features) if scale is None else np.asarray(scale, dtype=np.float64)
+
+        if tree is None:
+            tree_cls = sklearn.neighbors.KDTree if metric in sklearn.neighbors.KDTree.valid_metrics else sklearn.neighbors.BallTree
+            tree = tree_cls(self.core_points, leaf_size=leaf_size, metric=metric)
+        self.tree = tree
+
+    @classmethod
+    def from_model(cls, model, x_features, *, scaler=None, feature_names: Sequence[str] = None,
+                   metric: str = None, **kwargs) -> "DBSCANIndex":
+        """
+        Builds the index from a fitted DBSCAN and the x_features it was fit on. Models from a
+        run_DBSCAN_jobs sweep with a precomputed neighbor graph need the graph's metric passed
+        as metric (euclidean is assumed otherwise).
+        """
+        if metric is None:
+            metric = model.metric if model.metric != "precomputed" else "euclidean"
+        if feature_names is None and hasattr(x_features, "columns"):
+            feature_names = [str(col) for col in x_features.columns]
+        x = np.asarray(x_features, dtype=np.float64)
+        core = model.core_sample_indices_
+        return cls(
+            x[core], model.labels_[core], model.eps,
+            metric=metric,
+            feature_names=feature_names,
+            mean=getattr(scaler, "mean_", None),
+            scale=getattr(scaler, "scale_", None),
+            **kwargs
+        )
+
+    def predict(self, x, batch_size: int = 65536) -> np.ndarray:
+        if hasattr(x, "columns") and self.feature_names is not None:
+            x = x[self.feature_names]
+        x = np.asarray(x, dtype=np.float64)
+        if x.ndim != 2 or x.shape[1] != self.core_points.shape[1]:
+            raise ValueError(f"Argument 'x' must have shape (n, {self.core_points.shape[1]}) (got {x.shape})")
+
+        labels = np.full(len(x), -1, dtype=self.core_labels.dtype)
+        for start in range(0, len(x), batch_size):
+            batch = (x[start:start + batch_size] - self.mean) / self.scale
+            finite = np.isfinite(batch).all(axis=1)
+            if not finite.any():
+                continue
+            dist, ind = self.tree.query(batch[finite], k=1)
+            batch_labels = np.where(dist[:, 0] <= self.eps, self.core_labels[ind[:, 0]], -1)
+            labels[start:start + batch_size][finite] = batch_labels
+        return labels
+
+    def save(self, path: os.PathLike) -> Path:
+        """
+        Pickles the index with its built tree, so loading it doesn't rebuild anything
+        """
+        path = Path(path)
+        state = {
+            "format": INDEX_FORMAT,
+            "version": INDEX_VERSION,
+            "core_points": self.core_points,
+            "core_labels": self.core_labels,
+            "eps": self.eps,
+            "metric": self.metric,
+            "feature_names": self.feature_names,
+            "mean": self.mean,
+            "scale": self.scale,
+            "tree": self.tree,
+        }
+        with path.open("wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    @classmethod
+    def load(cls, path: os.PathLike) -> "DBSCANIndex":
+        """
+        Loads an index written by save(). This unpickles the file, so only load trusted files.
+        """
+        with Path(path).open("rb") as f:
+            state = pickle.load(f)
+        if not isinstance(state, dict) or state.get("format") != INDEX_FORMAT:
+            raise ValueError(f"File '{str(path)}' is not a DBSCAN index")
+        if state["version"] != INDEX_VERSION:
+            raise ValueError(f"File '{str(path)}' has unsupported DBSCAN index version {state['version']}")
+        return cls(
+            state["core_points"], state["core_labels"], state["eps"],
+            metric=state["metric"],
+            feature_names=state["feature_names"],
+            mean=state["mean"],
+            scale=state["scale"],
+            tree=state["tree"],
+        )
@@ -0,0 +1,339 @@
+import json
+import os
+import struct
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Sequence
+
+from .make_features import KNOWN_COL_NAMES, SENSOR_NAMES
+
+# File layout
+# magic (8 bytes) | version (u16) | metadata length (u32) | JSON metadata | padding | rows
+# Rows are fixed-width little-endian float64 records, one value per column, so the
+# writer can keep appending and the reader can memory-map the data section as a
+# (n_rows, n_cols) array without parsing anything.
+#
+# Event logs use the same header with "kind": "events", and their records are
+# (poll number u32, sensor index u8, time f8, value f8) for each PID response actually
+# received, instead of a full row per poll with the slow PIDs' cached values repeated.
+# The poll number is what groups events back into rows.
+
+DRIVE_LOG_MAGIC = b"DRVLOG\x00\x00"
+DRIVE_LOG_VERSION = 1
+DRIVE_LOG_SUFFIX = ".dlog"
+DRIVE_LOG_DTYPE = np.dtype("<f8")
+EVENT_LOG_SUFFIX = ".elog"
+EVENT_DTYPE = np.dtype([("poll", "<u4"), ("sensor", "u1"), ("time", "<f8"), ("value", "<f8")])
+HEADER_ALIGN = 64
+
+_PREAMBLE = struct.Struct("<8sHI")
+
+DRIVE_LOG_UNITS = {
+    "rpm_time": "s",                "rpm_value": "rpm",
+    "speed_time": "s",              "speed_value": "kph",
+    "maf_time": "s",                "maf_value": "gram/second",
+    "throttle_time": "s",           "throttle_value": "percent",
+    "engine_load_time": "s",        "engine_load_value": "percent",
+    "coolant_temp_time": "s",       "coolant_temp_value": "celsius",
+    "s_fuel_trim_time": "s",        "s_fuel_trim_value": "percent",
+    "l_fuel_trim_time": "s",        "l_fuel_trim_value": "percent",
+    "timing_advance_time": "s",     "timing_advance_value": "degrees",
+    "intake_temp_time": "s",        "intake_temp_value": "celsius",
+}
+
+
+def write_header(f, columns: Sequence[str] = KNOWN_COL_NAMES, units: dict = DRIVE_LOG_UNITS, **extra) -> int:
+    """
+    Writes the file header and returns the offset of the first row
+    """
+    meta = json.dumps({
+        "kind": "rows",
+        "columns": list(columns),
+        "dtype": DRIVE_LOG_DTYPE.str,
+        "units": {col: units.get(col) for col in columns},
+        **extra
+    }).encode("utf-8")
+    offset = _PREAMBLE.size + len(meta)
+    padding = -offset % HEADER_ALIGN
+    f.write(_PREAMBLE.pack(DRIVE_LOG_MAGIC, DRIVE_LOG_VERSION, len(meta) + padding))
+    f.write(meta + b" " * padding)
+    return offset + padding
+
+
+def read_header(f):
+    """
+    Reads the file header, returning (metadata, offset of the first row)
+    """
+    preamble = f.read(_PREAMBLE.size)
+    if len(preamble) < _PREAMBLE.size:
+        raise ValueError(f"File '{f.name}' is too short to be a drive log")
+    magic, version, meta_len = _PREAMBLE.unpack(preamble)
+    if magic != DRIVE_LOG_MAGIC:
+        raise ValueError(f"File '{f.name}' is not a drive log (bad magic {magic!r})")
+    if version != DRIVE_LOG_VERSION:
+        raise ValueError(f"File '{f.name}' has unsupported drive log version {version}")
+    meta = json.loads(f.read(meta_len).decode("utf-8"))
+    meta.setdefault("kind", "rows")
+    if meta["kind"] == "rows" and np.dtype(meta["dtype"]) != DRIVE_LOG_DTYPE:
+        raise ValueError(f"File '{f.name}' has unsupported dtype '{meta['dtype']}'")
+    if meta["kind"] == "events" and np.dtype([tuple(field) for field in meta["dtype"]]) != EVENT_DTYPE:
+        raise ValueError(f"File '{f.name}' has unsupported event dtype {meta['dtype']} (event logs without poll numbers can't be read)")
+    return meta, _PREAMBLE.size + meta_len
+
+
+def _read_header_kind(f, kind: str):
+    meta, offset = read_header(f)
+    if meta["kind"] != kind:
+        raise ValueError(f"File '{f.name}' holds {meta['kind']}, expected {kind}")
+    return meta, offset
+
+
+class DriveLogWriter:
+    """
+    Appends fixed-width float64 rows to a drive log. Opening an existing log appends
+    to it, dropping any partially written trailing row left by a crash.
+    """
+    def __init__(self, path: os.PathLike, columns: Sequence[str] = KNOWN_COL_NAMES):
+        self.path = Path(path)
+        self.columns = list(columns)
+        self.row_nbytes = DRIVE_LOG_DTYPE.itemsize * len(self.columns)
+
+        if self.path.is_file() and self.path.stat().st_size > 0:
+            self.file = self.path.open("r+b")
+            meta, offset = _read_header_kind(self.file, "rows")
+            if meta["columns"] != self.columns:
+                self.file.close()
+                raise ValueError(f"File '{str(self.path)}' has columns {meta['columns']}, expected {self.columns}")
+            size = self.file.seek(0, os.SEEK_END)
+            whole_rows_end = size - (size - offset) % self.row_nbytes
+            if whole_rows_end != size:
+                self.file.truncate(whole_rows_end)
+                self.file.seek(whole_rows_end)
+        else:
+            self.file = self.path.open("wb")
+            write_header(self.file, self.columns)
+
+    def append(self, row: Sequence[float]):
+        if len(row) != len(self.columns):
+            raise ValueError(f"Argument 'row' must have {len(self.columns)} values (got {len(row)})")
+        self.file.write(np.asarray(row, dtype=DRIVE_LOG_DTYPE).tobytes())
+
+    def append_rows(self, rows):
+        rows = np.asarray(rows, dtype=DRIVE_LOG_DTYPE)
+        if rows.ndim != 2 or rows.shape[1] != len(self.columns):
+            raise ValueError(f"Argument 'rows' must have shape (n, {len(self.columns)}) (got {rows.shape})")
+        self.file.write(np.ascontiguousarray(rows).tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_drive_log(path: os.PathLike):
+    """
+    Memory-maps a drive log, returning (metadata, read-only (n_rows, n_cols) float64 array)
+    """
+    path = Path(path)
+    with path.open("rb") as f:
+        meta, offset = _read_header_kind(f, "rows")
+        size = f.seek(0, os.SEEK_END)
+    n_cols = len(meta["columns"])
+    n_rows = (size - offset) // (DRIVE_LOG_DTYPE.itemsize * n_cols)
+    if n_rows == 0:
+        return meta, np.empty((0, n_cols), dtype=DRIVE_LOG_DTYPE)
+    data = np.memmap(path, dtype=DRIVE_LOG_DTYPE, mode="r", offset=offset, shape=(n_rows, n_cols))
+    return meta, data
+
+
+def load_drive_log(path: os.PathLike) -> pd.DataFrame:
+    """
+    Loads a drive log into a dataframe backed by the memory-mapped file
+    """
+    meta, data = open_drive_log(path)
+    return pd.DataFrame(data, columns=meta["columns"], copy=False)
+
+
+class EventLogWriter:
+    """
+    Appends (sensor index, time, value) events to an event log. Has the same append_rows/flush/
+    fileno/close interface as DriveLogWriter, but each "row" is the list of events from one poll,
+    holding only the PIDs that were actually queried. Every poll gets the next poll number,
+    continuing from the last one in the file when appending.
+    """
+    def __init__(self, path: os.PathLike, sensors: Sequence[str] = SENSOR_NAMES):
+        self.path = Path(path)
+        self.sensors = list(sensors)
+        if len(self.sensors) > 255:
+            raise ValueError(f"Argument 'sensors' has {len(self.sensors)} sensors, at most 255 fit in an event")
+
+        if self.path.is_file() and self.path.stat().st_size > 0:
+            self.file = self.path.open("r+b")
+            meta, offset = _read_header_kind(self.file, "events")
+            if meta["sensors"] != self.sensors:
+                self.file.close()
+                raise ValueError(f"File '{str(self.path)}' has sensors {meta['sensors']}, expected {self.sensors}")
+            size = self.file.seek(0, os.SEEK_END)
+            whole_events_end = size - (size - offset) % EVENT_DTYPE.itemsize
+            if whole_events_end != size:
+                self.file.truncate(whole_events_end)
+                self.file.seek(whole_events_end)
+            self.next_poll = 0
+            if whole_events_end > offset:
+                self.file.seek(whole_events_end - EVENT_DTYPE.itemsize)
+                last = np.frombuffer(self.file.read(EVENT_DTYPE.itemsize), dtype=EVENT_DTYPE)
+                self.next_poll = int(last["poll"][0]) + 1
+        else:
+            self.next_poll = 0
+            self.file = self.path.open("wb")
+            units = {s: DRIVE_LOG_UNITS.get(f"{s}_value") for s in self.sensors}
+            write_header(self.file, columns=list(EVENT_DTYPE.names), units=dict(),
+                         kind="events", dtype=EVENT_DTYPE.descr, sensors=self.sensors, sensor_units=units)
+
+    def append_events(self, events):
+        """
+        Appends the (sensor index, time, value) events of one poll
+        """
+        self.append_rows([events])
+
+    def append_rows(self, rows):
+        records = []
+        for row in rows:
+            records += [(self.next_poll, *e) for e in row]
+            self.next_poll += 1
+        self.file.write(np.array(records, dtype=EVENT_DTYPE).tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_event_log(path: os.PathLike):
+    """
+    Memory-maps an event log, returning (metadata, read-only EVENT_DTYPE record array)
+    """
+    path = Path(path)
+    with path.open("rb") as f:
+        meta, offset = _read_header_kind(f, "events")
+        size = f.seek(0, os.SEEK_END)
+    n_events = (size - offset) // EVENT_DTYPE.itemsize
+    if n_events == 0:
+        return meta, np.empty(0, dtype=EVENT_DTYPE)
+    return meta, np.memmap(path, dtype=EVENT_DTYPE, mode="r", offset=offset, shape=(n_events,))
+
+
+def _ffill(a: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """
+    Forward-fills the cells of a 2D array where present is False down its columns. Cells that
+    are present keep their value even when it's NaN (a null reply), and the rows above a
+    column's first present cell are taken from row 0.
+    """
+    idx = np.where(present, np.arange(len(a))[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return a[idx, np.arange(a.shape[1])]
+
+
+def load_event_log(path: os.PathLike) -> pd.DataFrame:
+    """
+    Rebuilds the dense KNOWN_COL_NAMES frame from an event log: one row per poll number with
+    any events, with the PIDs that weren't queried in it forward-filled from their last event.
+    """
+    meta, events = open_event_log(path)
+    n_sensors = len(meta["sensors"])
+    sensor = np.asarray(events["sensor"], dtype=np.intp)
+    polls, row = np.unique(events["poll"], return_inverse=True)
+
+    n_rows = len(polls)
+    times = np.full((n_rows, n_sensors), np.nan)
+    values = np.full((n_rows, n_sensors), np.nan)
+    times[row, sensor] = events["time"]
+    values[row, sensor] = events["value"]
+
+    dense = np.empty((n_rows, 2 * n_sensors))
+    # fill from the cells that had an event, not the non-NaN ones: a PID that was queried and
+    # didn't answer is NaN in that row, not its last good value
+    present = np.zeros((n_rows, n_sensors), dtype=bool)
+    present[row, sensor] = True
+    dense[:, 0::2] = _ffill(times, present)
+    dense[:, 1::2] = _ffill(values, present)
+    columns = [f"{s}_{part}" for s in meta["sensors"] for part in ("time", "value")]
+    return pd.DataFrame(dense, columns=columns)
+
+
+def csv_to_drive_log(csv_path: os.PathLike, out_path: os.PathLike = None) -> Path:
+    """
+    Converts a drive CSV written by get_drive_stats into a drive log
+    """
+    csv_path = Path(csv_path)
+    out_path = Path(out_path) if out_path is not None else csv_path.with_suffix(DRIVE_LOG_SUFFIX)
+    if out_path.exists():
+        raise FileExistsError(f"Cannot create file '{str(out_path)}' - File Exists")
+    df = pd.read_csv(csv_path, sep=",", names=KNOWN_COL_NAMES, dtype=DRIVE_LOG_DTYPE, float_precision="round_trip")
+    with DriveLogWriter(out_path) as writer:
+        writer.append_rows(df.to_numpy())
+    return out_path
+
+
+def drive_log_to_csv(log_path: os.PathLike, out_path: os.PathLike = None) -> Path:
+    """
+    Converts a drive log back into the CSV format written by get_drive_stats
+    """
+    log_path = Path(log_path)
+    out_path = Path(out_path) if out_path is not None else log_path.with_suffix(".csv")
+    if out_path.exists():
+        raise FileExistsError(f"Cannot create file '{str(out_path)}' - File Exists")
+    load_drive_log(log_path).to_csv(out_path, header=False, index=False, float_format="%.17g")
+    return out_path
+
+
+def event_log_to_csv(log_path: os.PathLike, out_path: os.PathLike = None) -> Path:
+    """
+    Converts an event log into the dense CSV format written by get_drive_stats
+    """
+    log_path = Path(log_path)
+    out_path = Path(out_path) if out_path is not None else log_path.with_suffix(".csv")
+    if out_path.exists():
+        raise FileExistsError(f"Cannot create file '{str(out_path)}' - File Exists")
+    load_event_log(log_path).to_csv(out_path, header=False, index=False, float_format="%.17g")
+    return out_path
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+            prog="python -m src.drive_log",
+            description="Converts drive CSV files to drive logs and back, based on the input suffix. "
+                        "Event logs are converted to CSV.",
+    )
+    parser.add_argument("inputs", nargs="+")
+    args = parser.parse_args()
+
+    for p in map(Path, args.inputs):
+        if p.suffix == DRIVE_LOG_SUFFIX:
+            print(f"{str(p)} -> {str(drive_log_to_csv(p))}")
+        elif p.suffix == EVENT_LOG_SUFFIX:
+            print(f"{str(p)} -> {str(event_log_to_csv(p))}")
+        else:
+            print(f"{str(p)} -> {str(csv_to_drive_log(p))}")
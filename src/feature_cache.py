@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+from .make_features import FEATURE_COL_NAMES, FEATURES_VERSION, get_data, make_features_clustering
+from .drive_log import DRIVE_LOG_SUFFIX, EVENT_LOG_SUFFIX, open_drive_log, load_event_log
+
+HASH_CHUNK_SZ = 1 << 20
+
+
+def file_hash(path: os.PathLike) -> str:
+    """
+    Content hash of a file, read in 1 MiB chunks
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with Path(path).open("rb") as f:
+        while chunk := f.read(HASH_CHUNK_SZ):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass
+class DriveEntry:
+    path:       str
+    size:       int
+    mtime_ns:   int
+    hash:       str
+    n_rows:     int
+    t_start:    float
+    t_end:      float
+
+
+def scan_drive(path: os.PathLike) -> DriveEntry:
+    """
+    Hashes a drive file and reads its row count and time span from the rpm_time column
+    """
+    path = Path(path)
+    st = path.stat()
+    if path.suffix == DRIVE_LOG_SUFFIX:
+        _, data = open_drive_log(path)
+        times = np.asarray(data[:, 0])
+    elif path.suffix == EVENT_LOG_SUFFIX:
+        times = load_event_log(path)["rpm_time"].to_numpy()
+    else:
+        times = pd.read_csv(path, sep=",", header=None, usecols=[0]).iloc[:, 0].to_numpy()
+    return DriveEntry(
+        path=str(path.resolve()),
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        hash=file_hash(path),
+        n_rows=len(times),
+        t_start=float(times[0]) if len(times) else float("nan"),
+        t_end=float(times[-1]) if len(times) else float("nan"),
+    )
+
+
+class DriveCatalog:
+    """
+    Persistent record of the drives seen so far, keyed by resolved path. A file is only
+    re-hashed and re-scanned when its size or mtime changed since it was recorded.
+    """
+    def __init__(self, catalog_path: os.PathLike):
+        self.catalog_path = Path(catalog_path)
+        self.entries = dict()
+        if self.catalog_path.is_file():
+            with self.catalog_path.open("r") as f:
+                self.entries = {e["path"]: DriveEntry(**e) for e in json.load(f)}
+
+    def entry(self, path: os.PathLike) -> DriveEntry:
+        path = Path(path).resolve()
+        st = path.stat()
+        e = self.entries.get(str(path))
+        if e is None or e.size != st.st_size or e.mtime_ns != st.st_mtime_ns:
+            e = scan_drive(path)
+            self.entries[e.path] = e
+            self.save()
+        return e
+
+    def prune(self):
+        """
+        Drops the entries for files that don't exist anymore
+        """
+        self.entries = {p: e for p, e in self.entries.items() if Path(p).is_file()}
+        self.save()
+
+    def save(self):
+        self.catalog_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.catalog_path.with_name(self.catalog_path.name + ".tmp")
+        with tmp.open("w") as f:
+            json.dump([asdict(e) for e in self.entries.values()], f, indent=1)
+        os.replace(tmp, self.catalog_path)
+
+
+class FeatureCache:
+    """
+    On-disk cache of make_features_clustering output, keyed by (file content hash, window size, hop,
+    sensor alignment, FEATURES_VERSION), so edited files and feature code changes never hit stale entries.
+    Entries are .npy files loaded as memory maps. Reading an entry bumps its mtime, and after
+    every insert the least recently used entries are evicted until the cache fits in max_bytes.
+    Entries from other FEATURES_VERSIONs are deleted outright.
+    """
+    def __init__(self, cache_dir: os.PathLike, *, max_bytes: int = 1 << 30, catalog: DriveCatalog = None):
+        if max_bytes <= 0:
+            raise ValueError(f"Argument 'max_bytes' (got {max_bytes}) cannot be negative or 0!")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.catalog = catalog if catalog is not None else DriveCatalog(self.cache_dir / "catalog.json")
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, file_hash: str, window_sz: int, hop: int = 1, align: str = None, period: float = None) -> Path:
+        aligned = ""
+        if align is not None:
+            aligned = f"-a{align}" + (f"-p{float(period)!r}" if period is not None else "")
+        return self.cache_dir / f"{file_hash}-w{window_sz}-h{hop}{aligned}-v{FEATURES_VERSION}.npy"
+
+    def get_features(self, path: os.PathLike, window_sz: int = 20, hop: int = 1, *, align: str = None,
+                     period: float = None) -> pd.DataFrame:
+        """
+        Features of a drive, loaded with get_data(path, align=align, period=period)
+        """
+        entry_path = self.entry_path(self.catalog.entry(path).hash, window_sz, hop, align, period)
+        if entry_path.is_file():
+            self.hits += 1
+            os.utime(entry_path)
+            return pd.DataFrame(np.load(entry_path, mmap_mode="r"), columns=FEATURE_COL_NAMES, copy=False)
+
+        self.misses += 1
+        features = make_features_clustering(get_data(path, align=align, period=period), window_sz, hop)
+        tmp = entry_path.with_name(entry_path.name + ".tmp")
+        with tmp.open("wb") as f:
+            np.save(f, features.to_numpy(dtype=np.float64))
+        os.replace(tmp, entry_path)
+        self.evict()
+        return features
+
+    def evict(self):
+        entries = []
+        for p in self.cache_dir.glob("*.npy"):
+            if not p.stem.endswith(f"-v{FEATURES_VERSION}"):
+                p.unlink()
+                continue
+            st = p.stat()
+            entries.append((st.st_mtime_ns, st.st_size, p))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            p.unlink()
+            total -= size
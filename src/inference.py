@@ -0,0 +1,113 @@
+import json
+import os
+import numpy as np
+from pathlib import Path
+from typing import Mapping, Sequence
+
+# Only NumPy is needed to load and run an artifact; scikit-learn models are read by attribute
+# when exporting and never imported, so this module stays cheap to import on the Pi.
+
+ARTIFACT_FORMAT = "driving-classifier/centroids"
+ARTIFACT_VERSION = 1
+
+
+def _scaling(scaler, n_features: int):
+    if scaler is None:
+        return np.zeros(n_features), np.ones(n_features)
+    mean = getattr(scaler, "mean_", None)
+    scale = getattr(scaler, "scale_", None)
+    mean = np.zeros(n_features) if mean is None else np.asarray(mean, dtype=np.float64)
+    scale = np.ones(n_features) if scale is None else np.asarray(scale, dtype=np.float64)
+    if mean.shape != (n_features,) or scale.shape != (n_features,):
+        raise ValueError(f"Argument 'scaler' was fit on {len(mean)} features, the model has {n_features}")
+    return mean, scale
+
+
+def export_kmeans_model(model, path: os.PathLike, *, feature_names: Sequence[str] = None, scaler=None,
+                        metadata: dict = None) -> Path:
+    """
+    Freezes a fitted (MiniBatch)KMeans into a .npz artifact: its centroids, the feature order they
+    expect, and the mean/scale of the StandardScaler the features went through before fitting (if any).
+    feature_names defaults to the model's feature_names_in_, then to make_features_clustering's columns.
+    """
+    centroids = np.asarray(model.cluster_centers_, dtype=np.float64)
+    n_features = centroids.shape[1]
+
+    if feature_names is None:
+        feature_names = getattr(model, "feature_names_in_", None)
+    if feature_names is None:
+        from .make_features import FEATURE_COL_NAMES
+        feature_names = FEATURE_COL_NAMES
+    feature_names = [str(name) for name in feature_names]
+    if len(feature_names) != n_features:
+        raise ValueError(f"Argument 'feature_names' has {len(feature_names)} names, the model has {n_features} features")
+
+    mean, scale = _scaling(scaler, n_features)
+    meta = {
+        "format": ARTIFACT_FORMAT,
+        "version": ARTIFACT_VERSION,
+        "model": type(model).__name__,
+        "n_clusters": len(centroids),
+        **(metadata or dict()),
+    }
+
+    path = Path(path)
+    with path.open("wb") as f:
+        np.savez(f, centroids=centroids, mean=mean, scale=scale,
+                 feature_names=np.array(feature_names), meta=np.array(json.dumps(meta)))
+    return path
+
+
+class CentroidClassifier:
+    """
+    NumPy-only nearest centroid labeler for artifacts from export_kmeans_model. Gives the same
+    labels as the exported model's predict(); rows with NaN or inf features get -1.
+    """
+    def __init__(self, centroids, feature_names: Sequence[str], mean=None, scale=None, metadata: dict = None):
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.feature_names = list(feature_names)
+        n_features = self.centroids.shape[1]
+        self.mean = np.zeros(n_features) if mean is None else np.asarray(mean, dtype=np.float64)
+        self.scale = np.ones(n_features) if scale is None else np.asarray(scale, dtype=np.float64)
+        self.metadata = metadata or dict()
+        self.centroid_sq_norms = (self.centroids ** 2).sum(axis=1)
+
+    @classmethod
+    def load(cls, path: os.PathLike) -> "CentroidClassifier":
+        with np.load(path, allow_pickle=False) as artifact:
+            meta = json.loads(str(artifact["meta"]))
+            if meta.get("format") != ARTIFACT_FORMAT:
+                raise ValueError(f"File '{str(path)}' is not a centroid artifact (format '{meta.get('format')}')")
+            if meta.get("version") != ARTIFACT_VERSION:
+                raise ValueError(f"File '{str(path)}' has unsupported artifact version {meta.get('version')}")
+            return cls(artifact["centroids"], artifact["feature_names"].tolist(),
+                       artifact["mean"], artifact["scale"], meta)
+
+    def _as_matrix(self, x) -> np.ndarray:
+        if hasattr(x, "columns"):
+            x = x[self.feature_names]
+        x = np.asarray(x, dtype=np.float64)
+        if x.ndim != 2 or x.shape[1] != len(self.feature_names):
+            raise ValueError(f"Argument 'x' must have shape (n, {len(self.feature_names)}) (got {x.shape})")
+        return x
+
+    def predict(self, x, batch_size: int = 65536) -> np.ndarray:
+        """
+        Labels feature windows (an (n, n_features) array or a dataframe with the feature columns)
+        """
+        x = self._as_matrix(x)
+        labels = np.empty(len(x), dtype=np.intp)
+        for start in range(0, len(x), batch_size):
+            batch = (x[start:start + batch_size] - self.mean) / self.scale
+            # ||x - c||^2 without the ||x||^2 term, which doesn't change the argmin
+            dists = self.centroid_sq_norms - 2.0 * batch @ self.centroids.T
+            batch_labels = dists.argmin(axis=1)
+            batch_labels[~np.isfinite(batch).all(axis=1)] = -1
+            labels[start:start + batch_size] = batch_labels
+        return labels
+
+    def predict_row(self, row: Mapping[str, float]) -> int:
+        """
+        Labels one feature row keyed by name, e.g. StreamingFeatureExtractor.update() output
+        """
+        return int(self.predict(np.array([[row[name] for name in self.feature_names]]))[0])
@@ -0,0 +1,153 @@
+import csv
+import os
+import queue
+import threading
+import time
+from typing import Callable, Sequence
+
+
+class CSVRowSink:
+    """
+    Gives a text file the append_rows/flush/fileno/close interface DriveLogWriter has
+    """
+    def __init__(self, file):
+        self.file = file
+        self.writer = csv.writer(file, delimiter=",")
+
+    def append_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+_STOP = object()
+
+
+class BufferedLogWriter:
+    """
+    Moves log writes off the polling thread. submit() only puts the row on a bounded queue and never
+    blocks; a background thread drains it in batches of up to batch_size rows into the sink (anything
+    with append_rows/flush/fileno, e.g. DriveLogWriter or CSVRowSink), flushes at most every
+    flush_interval seconds and fsyncs at most every fsync_interval seconds (None to never fsync).
+    Rows submitted while the queue is full are dropped and counted. With console_interval, the latest
+    row is printed from the background thread at most that often.
+    """
+    def __init__(self, sink, *, maxsize: int = 4096, batch_size: int = 256, flush_interval: float = 1.0,
+                 fsync_interval: float = 10.0, console_interval: float = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if maxsize <= 0:
+            raise ValueError(f"Argument 'maxsize' (got {maxsize}) cannot be negative or 0!")
+        if batch_size <= 0:
+            raise ValueError(f"Argument 'batch_size' (got {batch_size}) cannot be negative or 0!")
+        if flush_interval <= 0:
+            raise ValueError(f"Argument 'flush_interval' (got {flush_interval}) cannot be negative or 0!")
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.console_interval = console_interval
+        self.clock = clock
+
+        self.submitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.error = None
+
+        self.thread = threading.Thread(target=self._run, name="BufferedLogWriter", daemon=True)
+        self.thread.start()
+
+    def submit(self, row: Sequence[float]) -> bool:
+        """
+        Queues a row for writing, returning False if it was dropped because the queue was full
+        """
+        if self.error is not None:
+            raise RuntimeError("Log writer thread failed") from self.error
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
+
+    def close(self):
+        """
+        Writes out everything still queued, flushes and fsyncs the sink, and stops the thread.
+        The sink itself is left open.
+        """
+        if self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+        if self.error is not None:
+            raise RuntimeError("Log writer thread failed") from self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _sync(self, fsync: bool):
+        self.sink.flush()
+        if fsync:
+            os.fsync(self.sink.fileno())
+
+    def _run(self):
+        last_flush = last_fsync = last_console = self.clock()
+        latest = None
+        stopping = False
+        try:
+            while not stopping:
+                batch = []
+                try:
+                    batch.append(self.queue.get(timeout=self.flush_interval))
+                    while len(batch) < self.batch_size:
+                        batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    pass
+                if batch and batch[-1] is _STOP:
+                    batch.pop()
+                    stopping = True
+
+                if batch:
+                    self.sink.append_rows(batch)
+                    self.written += len(batch)
+                    self.batches += 1
+                    latest = batch[-1]
+
+                now = self.clock()
+                if now - last_flush >= self.flush_interval:
+                    fsync = self.fsync_interval is not None and now - last_fsync >= self.fsync_interval
+                    self._sync(fsync)
+                    last_flush = now
+                    if fsync:
+                        last_fsync = now
+                if self.console_interval is not None and latest is not None and now - last_console >= self.console_interval:
+                    print(latest)
+                    latest = None
+                    last_console = now
+
+            self._sync(self.fsync_interval is not None)
+        except Exception as e:
+            self.error = e
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 from pathlib import Path
+from typing import Iterable, Iterator, List, Sequence
 import os
 
 KNOWN_COL_NAMES = [
@@ -16,6 +17,35 @@ KNOWN_COL_NAMES = [
         "intake_temp_time", "intake_temp_value"
 ]
 
+SENSOR_NAMES = [col[:-len("_time")] for col in KNOWN_COL_NAMES[::2]]
+
+def _rate(series: pd.Series, time_diff: pd.Series) -> pd.Series:
+    """
+    series.diff() / time_diff, with NaN instead of +-inf where time_diff is 0 (a cached response
+    re-logged with its old timestamp), so one repeated timestamp can't poison the window aggregates
+    """
+    rate = series.diff() / time_diff
+    return rate.mask(np.isinf(rate))
+
+def add_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the time derivatives (acceleration, jerk, rates) used for the features, in place.
+    Derivatives over a zero time difference are NaN, like missing samples, rather than +-inf.
+    """
+    ## need to get derivatives of cols like speed to get accleration
+    df["time_diff"] = df["rpm_time"].diff() # We'll just use the rpm's time as the baseline for time - FOR NOW
+    df["rpm_accel"] = _rate(df["rpm_value"], df["time_diff"])
+    df["rpm_jerk"] = _rate(df["rpm_accel"], df["time_diff"])
+
+    df["speed_accel"] = _rate(df["speed_value"], df["time_diff"])
+    df["speed_jerk"] = _rate(df["speed_accel"], df["time_diff"])
+
+    df["maf_accel"] = _rate(df["maf_value"], df["time_diff"])
+
+    df["throttle_rate"] = _rate(df["throttle_value"], df["time_diff"])
+
+    return df
+
 def get_data_from_csv(path: os.PathLike) -> pd.DataFrame:
     """
     Convenience function to load a CSV file into a Pandas dataframe
@@ -26,68 +56,259 @@ def get_data_from_csv(path: os.PathLike) -> pd.DataFrame:
     csv_file = Path(path)
     df = pd.read_csv(path, sep=",", names=KNOWN_COL_NAMES)
 
-    ## need to get derivatives of cols like speed to get accleration
-    df["time_diff"] = df["rpm_time"].diff() # We'll just use the rpm's time as the baseline for time - FOR NOW
-    df["rpm_accel"] = df["rpm_value"].diff() / df["time_diff"]
-    df["rpm_jerk"] = df["rpm_accel"].diff() / df["time_diff"]
+    return add_derived_columns(df)
 
-    df["speed_accel"] = df["speed_value"].diff() / df["time_diff"]
-    df["speed_jerk"] = df["speed_accel"].diff() / df["time_diff"]
+def get_data_from_drive_log(path: os.PathLike) -> pd.DataFrame:
+    """
+    Same as get_data_from_csv, but for a binary drive log. The sensor columns are
+    backed by the memory-mapped file, so only the derived columns are allocated.
+    """
+    if not isinstance(path, (str, bytes, os.PathLike)):
+        raise ValueError(f"Argument 'path' is not of str, bytes, or os.PathLike instance. Got '{path}'")
+
+    from .drive_log import load_drive_log
+    return add_derived_columns(load_drive_log(path))
+
+def get_data_from_event_log(path: os.PathLike) -> pd.DataFrame:
+    """
+    Same as get_data_from_csv, but for a sparse event log, which gets forward-filled into the dense layout
+    """
+    if not isinstance(path, (str, bytes, os.PathLike)):
+        raise ValueError(f"Argument 'path' is not of str, bytes, or os.PathLike instance. Got '{path}'")
+
+    from .drive_log import load_event_log
+    return add_derived_columns(load_event_log(path))
+
+def align_sensors(df: pd.DataFrame, *, period: float = None, method: str = "interp", drop_repeats: bool = False) -> pd.DataFrame:
+    """
+    Resamples every sensor from its own *_time column onto one uniform time grid, returned in the
+    KNOWN_COL_NAMES layout with every *_time column set to the grid. The grid covers the span all
+    sensors have data for, every period seconds (the median rpm sample spacing if None).
+    method is "interp" for linear interpolation or "hold" for the last value at or before each point.
+    Samples sharing a timestamp (cached responses) are kept once; with drop_repeats, runs of the
+    same value are also collapsed to their first sample, for logs that re-stamped cached values.
+    """
+    if method not in ("interp", "hold"):
+        raise ValueError(f"Argument 'method' (got '{method}') must be 'interp' or 'hold'")
+    if period is not None and period <= 0:
+        raise ValueError(f"Argument 'period' (got {period}) cannot be negative or 0!")
+
+    channels = []
+    for name in SENSOR_NAMES:
+        t = df[f"{name}_time"].to_numpy(dtype=np.float64)
+        v = df[f"{name}_value"].to_numpy(dtype=np.float64)
+        valid = ~(np.isnan(t) | np.isnan(v))
+        t, v = t[valid], v[valid]
+        order = np.argsort(t, kind="stable")
+        t, v = t[order], v[order]
+        t, first = np.unique(t, return_index=True)
+        v = v[first]
+        if drop_repeats and len(v) > 1:
+            changed = np.concatenate(([True], v[1:] != v[:-1]))
+            t, v = t[changed], v[changed]
+        if len(t) == 0:
+            raise ValueError(f"Sensor '{name}' has no valid samples to align")
+        channels.append((name, t, v))
 
-    df["maf_accel"] = df["maf_value"].diff() / df["time_diff"]
+    if period is None:
+        rpm_t = channels[0][1]
+        period = float(np.median(np.diff(rpm_t))) if len(rpm_t) > 1 else 1.0
 
-    df["throttle_rate"] = df["throttle_value"].diff() / df["time_diff"]
+    start = max(t[0] for _, t, _ in channels)
+    end = min(t[-1] for _, t, _ in channels)
+    n = int(np.floor((end - start) / period)) + 1 if end >= start else 0
+    grid = start + period * np.arange(n)
 
+    aligned = dict()
+    for name, t, v in channels:
+        aligned[f"{name}_time"] = grid
+        if method == "interp":
+            aligned[f"{name}_value"] = np.interp(grid, t, v)
+        else:
+            aligned[f"{name}_value"] = v[np.searchsorted(t, grid, side="right") - 1]
+    return pd.DataFrame(aligned, columns=KNOWN_COL_NAMES)
+
+def get_data(path: os.PathLike, *, align: str = None, period: float = None) -> pd.DataFrame:
+    """
+    Loads a drive from a CSV file, a drive log or an event log, based on its suffix.
+    With align ("interp" or "hold"), the sensors are resampled with align_sensors first.
+    """
+    from .drive_log import DRIVE_LOG_SUFFIX, EVENT_LOG_SUFFIX
+    suffix = Path(os.fsdecode(path)).suffix
+    if suffix == DRIVE_LOG_SUFFIX:
+        df = get_data_from_drive_log(path)
+    elif suffix == EVENT_LOG_SUFFIX:
+        df = get_data_from_event_log(path)
+    else:
+        df = get_data_from_csv(path)
+
+    if align is not None:
+        df = add_derived_columns(align_sensors(df, period=period, method=align))
     return df
 
-def make_features_clustering(df: pd.DataFrame, window_sz: int = 20) -> pd.DataFrame:
+def iter_data_blocks(path: os.PathLike, block_size: int) -> Iterator[pd.DataFrame]:
     """
-    Returns raw, unscaled features from a given dataframe
+    Yields a drive's sensor columns (no derived columns) in consecutive blocks of block_size rows.
+    CSV files are read block by block and drive logs are sliced from the memory map, so only a block
+    is in memory at a time. Event logs are rebuilt whole before slicing, as the forward-fill needs
+    every earlier event.
     """
-    features = pd.DataFrame()
-    windows = []
-    for window in df.rolling(window_sz):
-        row = {}
-        
-        row["rpm_std"] = window["rpm_value"].std()
-        row["rpm_mean"] = window["rpm_value"].mean()
-       
-        row["rpm_accel_std"] = window["rpm_accel"].std()
-        row["rpm_accel_mean"] = window["rpm_accel"].mean()
-        row["rpm_accel_min"] = window["rpm_accel"].min()
-        row["rpm_accel_max"] = window["rpm_accel"].max()
+    if block_size < 1:
+        raise ValueError(f"Argument 'block_size' (got {block_size}) must be 1 or larger")
+
+    from .drive_log import DRIVE_LOG_SUFFIX, EVENT_LOG_SUFFIX, open_drive_log, load_event_log
+    suffix = Path(os.fsdecode(path)).suffix
+    if suffix == DRIVE_LOG_SUFFIX:
+        meta, data = open_drive_log(path)
+        for start in range(0, len(data), block_size):
+            yield pd.DataFrame(np.array(data[start:start + block_size]), columns=meta["columns"])
+    elif suffix == EVENT_LOG_SUFFIX:
+        df = load_event_log(path)
+        for start in range(0, len(df), block_size):
+            yield df.iloc[start:start + block_size].reset_index(drop=True)
+    else:
+        with pd.read_csv(path, sep=",", names=KNOWN_COL_NAMES, chunksize=block_size) as reader:
+            yield from reader
 
-        row["rpm_jerk_max_abs"] = window["rpm_jerk"].abs().max()
+# (feature name, source column, rolling aggregation) - in output column order
+FEATURE_SPEC = [
+        ("rpm_std", "rpm_value", "std"),
+        ("rpm_mean", "rpm_value", "mean"),
 
-        row["speed_std"] = window["speed_value"].std()
-        row["speed_mean"] = window["speed_value"].mean()
+        ("rpm_accel_std", "rpm_accel", "std"),
+        ("rpm_accel_mean", "rpm_accel", "mean"),
+        ("rpm_accel_min", "rpm_accel", "min"),
+        ("rpm_accel_max", "rpm_accel", "max"),
 
-        row["speed_accel_std"] = window["speed_accel"].std()
-        row["speed_accel_mean"] = window["speed_accel"].mean()
-        row["speed_accel_min"] = window["speed_accel"].min()
-        row["speed_accel_max"] = window["speed_accel"].max()
+        ("rpm_jerk_max_abs", "rpm_jerk", "max_abs"),
 
-        row["speed_jerk_max_abs"] = window["speed_jerk"].abs().max()
+        ("speed_std", "speed_value", "std"),
+        ("speed_mean", "speed_value", "mean"),
 
-        row["maf_std"] = window["maf_value"].std()
-        row["maf_mean"] = window["maf_value"].mean()
+        ("speed_accel_std", "speed_accel", "std"),
+        ("speed_accel_mean", "speed_accel", "mean"),
+        ("speed_accel_min", "speed_accel", "min"),
+        ("speed_accel_max", "speed_accel", "max"),
 
-        row["maf_accel_std"] = window["maf_accel"].std()
-        row["maf_accel_mean"] = window["maf_accel"].mean()
-        row["maf_accel_min"] = window["maf_accel"].min()
-        row["maf_accel_max"] = window["maf_accel"].max()
+        ("speed_jerk_max_abs", "speed_jerk", "max_abs"),
 
-        row["throttle_std"] = window["throttle_value"].std()
-        row["throttle_mean"] = window["throttle_value"].mean()
+        ("maf_std", "maf_value", "std"),
+        ("maf_mean", "maf_value", "mean"),
 
-        row["throttle_rate_std"] = window["throttle_rate"].std()
-        row["throttle_rate_mean"] = window["throttle_rate"].mean()
-        row["throttle_rate_min"] = window["throttle_rate"].min()
-        row["throttle_rate_max"] = window["throttle_rate"].max()
+        ("maf_accel_std", "maf_accel", "std"),
+        ("maf_accel_mean", "maf_accel", "mean"),
+        ("maf_accel_min", "maf_accel", "min"),
+        ("maf_accel_max", "maf_accel", "max"),
 
-        windows.append(row)
+        ("throttle_std", "throttle_value", "std"),
+        ("throttle_mean", "throttle_value", "mean"),
 
-    return pd.DataFrame(windows)
+        ("throttle_rate_std", "throttle_rate", "std"),
+        ("throttle_rate_mean", "throttle_rate", "mean"),
+        ("throttle_rate_min", "throttle_rate", "min"),
+        ("throttle_rate_max", "throttle_rate", "max"),
+]
+
+FEATURE_COL_NAMES = [name for name, _, _ in FEATURE_SPEC]
+
+# Bump this whenever the derived columns or the features change, it invalidates cached features
+FEATURES_VERSION = 1
+
+def make_features_clustering(df: pd.DataFrame, window_sz: int = 20, hop: int = 1) -> pd.DataFrame:
+    """
+    Returns raw, unscaled features from a given dataframe
+
+    Every row is computed over the (up to) window_sz rows ending at that row,
+    so the first window_sz - 1 rows are computed over partial windows.
+    NaNs (including the derivatives add_derived_columns leaves NaN) are skipped within a window.
+    With hop > 1, only the windows ending at every hop-th row (starting with the first) are computed.
+    """
+    if window_sz < 1:
+        raise ValueError(f"Argument 'window_sz' (got {window_sz}) must be 1 or larger")
+    if hop < 1:
+        raise ValueError(f"Argument 'hop' (got {hop}) must be 1 or larger")
+
+    features = {}
+    for name, col, agg in FEATURE_SPEC:
+        series = df[col]
+        if agg == "max_abs":
+            series = series.abs()
+            agg = "max"
+        # min_periods=1 keeps the partial leading windows the row-by-row version produced
+        rolling = series.rolling(window_sz, min_periods=1, step=hop)
+        features[name] = getattr(rolling, agg)().to_numpy()
+
+    return pd.DataFrame(features, columns=FEATURE_COL_NAMES)
+
+def _iter_drive_features(path: os.PathLike, window_sz: int, hop: int, block_size: int) -> Iterator[pd.DataFrame]:
+    """
+    make_features_clustering(get_data(path), window_sz, hop), computed block by block. Each block
+    is extended with enough of the rows before it for its first windows (and the derivatives in
+    them), chosen so the strided windows land on the same rows as for the whole drive.
+    """
+    tail = None
+    start = 0
+    for block in iter_data_blocks(path, block_size):
+        # window_sz - 1 rows for the window, plus 2 for the first derivatives in it (jerk is a 2nd difference)
+        overlap = 0
+        if tail is not None:
+            overlap = window_sz + 1
+            overlap = min(overlap + (start - overlap) % hop, len(tail))
+        ext = pd.concat([tail.iloc[len(tail) - overlap:], block], ignore_index=True) if overlap else block.reset_index(drop=True)
+        features = make_features_clustering(add_derived_columns(ext.copy()), window_sz, hop)
+        # rows of ext the features were computed at, as row numbers in the drive
+        rows = start - overlap + hop * np.arange(len(features))
+        keep = rows >= start
+        features = features[keep]
+        features.index = rows[keep] // hop
+        yield features
+
+        tail = ext.iloc[-(window_sz + hop):]
+        start += len(block)
+
+def _select_features(features: pd.DataFrame, columns: Sequence[str], dropna: bool) -> pd.DataFrame:
+    if columns is not None:
+        features = features[list(columns)]
+    if dropna:
+        features = features.replace([np.inf, -np.inf], np.nan).dropna()
+    return features
+
+def iter_feature_chunks(paths: Iterable[os.PathLike], *, window_sz: int = 20, hop: int = 1, chunk_size: int = 10000, dropna: bool = True, cache=None, columns: Sequence[str] = None, align: str = None, period: float = None) -> Iterator[pd.DataFrame]:
+    """
+    Yields make_features_clustering features drive by drive, in chunks of at most chunk_size rows.
+    Drives are read and featurized in blocks of about chunk_size windows (see iter_data_blocks), so
+    peak memory follows chunk_size, not the length of the drive. With align, a drive is resampled
+    and featurized whole, and so is a drive missing from the cache, so then it's the longest drive
+    that sets the peak. With dropna, rows with NaN or inf features (the leading partial windows,
+    mostly) are dropped since the estimators can't take them.
+    With a feature_cache.FeatureCache, drives that were seen before aren't re-parsed.
+    columns limits the chunks to a subset of the features, e.g. from select_uncorrelated_features.
+    align and period are passed to get_data, to compute the features on time-aligned sensors.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"Argument 'chunk_size' (got {chunk_size}) must be 1 or larger")
+
+    for path in paths:
+        if cache is not None:
+            blocks = [cache.get_features(path, window_sz, hop, align=align, period=period)]
+        elif align is not None:
+            blocks = [make_features_clustering(get_data(path, align=align, period=period), window_sz, hop)]
+        else:
+            blocks = _iter_drive_features(path, window_sz, hop, chunk_size * hop)
+
+        pending = []
+        n_pending = 0
+        for features in blocks:
+            features = _select_features(features, columns, dropna)
+            pending.append(features)
+            n_pending += len(features)
+            while n_pending >= chunk_size:
+                merged = pd.concat(pending) if len(pending) > 1 else pending[0]
+                yield merged.iloc[:chunk_size]
+                pending = [merged.iloc[chunk_size:]]
+                n_pending -= chunk_size
+        if n_pending:
+            yield pd.concat(pending) if len(pending) > 1 else pending[0]
 
 def get_upper_corr_matrix(df: pd.DataFrame):
     """
@@ -95,3 +316,93 @@ def get_upper_corr_matrix(df: pd.DataFrame):
     """
     corr = df.corr()
     upper_corr = corr.where(np.triu(np.ones(corr.shape), k=1).astype(bool))
+    return upper_corr
+
+class RunningCovariance:
+    """
+    Running mean and co-moment matrix of a set of columns, updated one chunk at a time and
+    mergeable across accumulators (Chan et al.'s pairwise update), so the correlation of a whole
+    corpus can be built drive by drive, or in parallel, without concatenating anything.
+    Rows with any NaN or inf are skipped, so it matches df.dropna().corr() rather than df.corr().
+    """
+    def __init__(self, columns: Sequence[str] = None):
+        self.columns = list(columns) if columns is not None else None
+        self.n = 0
+        self.mean = None
+        self.comoment = None
+
+    def update(self, chunk) -> "RunningCovariance":
+        if hasattr(chunk, "columns"):
+            if self.columns is None:
+                self.columns = list(chunk.columns)
+            chunk = chunk[self.columns]
+        x = np.asarray(chunk, dtype=np.float64)
+        x = x[np.isfinite(x).all(axis=1)]
+        if len(x) == 0:
+            return self
+
+        other = RunningCovariance(self.columns)
+        other.n = len(x)
+        other.mean = x.mean(axis=0)
+        centered = x - other.mean
+        other.comoment = centered.T @ centered
+        return self.merge(other)
+
+    def merge(self, other: "RunningCovariance") -> "RunningCovariance":
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.columns = self.columns if self.columns is not None else other.columns
+            self.n, self.mean, self.comoment = other.n, other.mean.copy(), other.comoment.copy()
+            return self
+        if other.columns is not None and self.columns is not None and other.columns != self.columns:
+            raise ValueError("Cannot merge covariance accumulators over different columns")
+
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.comoment = self.comoment + other.comoment + np.outer(delta, delta) * (self.n * other.n / n)
+        self.mean = self.mean + delta * (other.n / n)
+        self.n = n
+        return self
+
+    def _check_rows(self):
+        if self.n < 2:
+            raise ValueError(f"Need at least 2 rows without NaN or inf to compute a covariance (got {self.n})")
+
+    def cov(self, ddof: int = 1) -> pd.DataFrame:
+        self._check_rows()
+        return pd.DataFrame(self.comoment / (self.n - ddof), index=self.columns, columns=self.columns)
+
+    def corr(self) -> pd.DataFrame:
+        self._check_rows()
+        std = np.sqrt(np.diag(self.comoment))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = self.comoment / np.outer(std, std)
+        np.fill_diagonal(corr, 1.0)
+        return pd.DataFrame(np.clip(corr, -1.0, 1.0), index=self.columns, columns=self.columns)
+
+def get_corpus_corr_matrix(paths: Iterable[os.PathLike], **kwargs) -> pd.DataFrame:
+    """
+    Feature correlation matrix over many drives, one chunk at a time. Takes iter_feature_chunks' keyword arguments.
+    """
+    acc = RunningCovariance()
+    for chunk in iter_feature_chunks(paths, **kwargs):
+        acc.update(chunk)
+    return acc.corr()
+
+def select_uncorrelated_features(corr: pd.DataFrame, threshold: float = 0.9) -> List[str]:
+    """
+    Greedily keeps features, in column order, whose absolute correlation with every feature kept
+    so far is below threshold. Feed the result to the clustering functions as x_features[selected],
+    or to iter_feature_chunks(columns=selected).
+    """
+    if not 0 < threshold <= 1:
+        raise ValueError(f"Argument 'threshold' (got {threshold}) must be in (0, 1]")
+
+    abs_corr = corr.abs().to_numpy()
+    kept = []
+    for i in range(len(corr.columns)):
+        # NaN correlations (constant features) never count as correlated
+        if not kept or not (abs_corr[i, kept] >= threshold).any():
+            kept.append(i)
+    return [corr.columns[i] for i in kept]
@@ -0,0 +1,230 @@
+import bisect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+# Upper edges of the latency histogram buckets in seconds, the last bucket catches everything slower
+LATENCY_BUCKETS = [0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0, 2.0]
+
+
+def write_json(path: os.PathLike, obj):
+    """
+    Atomically replaces path with obj as JSON
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w") as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp, path)
+
+
+class LatencyHistogram:
+    """
+    Fixed bucket histogram, so observing a sample is a bisect and an increment
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.n += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper edge of the bucket holding the q quantile, capped at the largest sample seen
+        """
+        if self.n == 0:
+            return float("nan")
+        rank = q * self.n
+        seen = 0
+        for edge, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(edge, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.n,
+            "mean": self.total / self.n if self.n else None,
+            "p50": self.quantile(0.5) if self.n else None,
+            "p95": self.quantile(0.95) if self.n else None,
+            "max": self.max if self.n else None,
+            "buckets": {f"le_{edge}": c for edge, c in zip(self.buckets, self.counts)} | {"overflow": self.counts[-1]},
+        }
+
+
+class PIDStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.queries = 0
+        self.cache_hits = 0
+        self.skips = 0
+        self.nulls = 0
+
+    def to_dict(self) -> dict:
+        served = self.queries + self.cache_hits
+        return {
+            "queries": self.queries,
+            "cache_hits": self.cache_hits,
+            "cache_hit_ratio": self.cache_hits / served if served else None,
+            "skips": self.skips,
+            "nulls": self.nulls,
+            "null_ratio": self.nulls / self.queries if self.queries else None,
+            "latency": self.latency.to_dict(),
+        }
+
+
+class PollMetrics:
+    """
+    Counters for the polling loop: per-PID query latency, null responses, cache hits (cycles
+    where the scheduler served the last value instead of querying), skips (every-cycle PIDs left
+    out by the query budget), and the loop rate.
+    Everything is plain counters, so recording costs next to nothing next to a serial round-trip.
+    Snapshots are only taken here; hand them to a MetricsFileWriter to get them on disk.
+    """
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.pids = dict()
+        self.cycles = 0
+        self.cycle_time = LatencyHistogram()
+        self.last_write = self.start
+        self.last_write_cycles = 0
+
+    def pid(self, name: str) -> PIDStats:
+        stats = self.pids.get(name)
+        if stats is None:
+            stats = self.pids[name] = PIDStats()
+        return stats
+
+    def record_query(self, name: str, seconds: float, null: bool):
+        stats = self.pid(name)
+        stats.queries += 1
+        stats.latency.observe(seconds)
+        if null:
+            stats.nulls += 1
+
+    def record_cache_hit(self, name: str):
+        self.pid(name).cache_hits += 1
+
+    def record_skip(self, name: str):
+        """
+        A PID due every cycle that was left out by the query budget, and logged as null
+        """
+        self.pid(name).skips += 1
+
+    def record_cycle(self, seconds: float):
+        self.cycles += 1
+        self.cycle_time.observe(seconds)
+
+    def snapshot(self) -> dict:
+        now = self.clock()
+        elapsed = now - self.start
+        since_write = now - self.last_write
+        return {
+            "uptime": elapsed,
+            "cycles": self.cycles,
+            "samples_per_sec": self.cycles / elapsed if elapsed > 0 else None,
+            "recent_samples_per_sec": (self.cycles - self.last_write_cycles) / since_write if since_write > 0 else None,
+            "cycle_time": self.cycle_time.to_dict(),
+            "pids": {name: stats.to_dict() for name, stats in self.pids.items()},
+        }
+
+    def take_snapshot(self, **extra) -> dict:
+        """
+        snapshot() plus any extra top-level entries, starting a new "recent" period
+        """
+        snapshot = self.snapshot()
+        snapshot.update(extra)
+        self.last_write = self.clock()
+        self.last_write_cycles = self.cycles
+        return snapshot
+
+    def maybe_snapshot(self, interval: float, **extra) -> Optional[dict]:
+        """
+        take_snapshot() if interval seconds have passed since the last one, else None
+        """
+        if self.clock() - self.last_write < interval:
+            return None
+        return self.take_snapshot(**extra)
+
+    def summary(self) -> str:
+        s = self.snapshot()
+        rate = s["samples_per_sec"] or 0.0
+        lines = [f"{s['cycles']} samples in {s['uptime']:.1f}s ({rate:.2f} samples/s)",
+                 f"{'PID':>20} {'queries':>8} {'hits':>8} {'hit %':>6} {'nulls':>6} {'skips':>6} {'mean ms':>8} {'p95 ms':>8} {'max ms':>8}"]
+        for name, p in s["pids"].items():
+            lat = p["latency"]
+            ms = lambda v: f"{v * 1000:.1f}" if v is not None else "-"
+            ratio = f"{p['cache_hit_ratio'] * 100:.0f}" if p["cache_hit_ratio"] is not None else "-"
+            lines.append(f"{name:>20} {p['queries']:>8} {p['cache_hits']:>8} {ratio:>6} {p['nulls']:>6} {p['skips']:>6} "
+                         f"{ms(lat['mean']):>8} {ms(lat['p95']):>8} {ms(lat['max']):>8}")
+        return "\n".join(lines)
+
+
+class MetricsFileWriter:
+    """
+    Writes metrics snapshots to a JSON file from a background thread, so the polling thread never
+    waits on the disk. submit() only swaps in the snapshot; if the thread is still busy with an
+    older one, the older pending snapshot is replaced rather than queued.
+    """
+    def __init__(self, path: os.PathLike):
+        self.path = Path(path)
+        self.pending = None
+        self.stopping = False
+        self.written = 0
+        self.error = None
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="MetricsFileWriter", daemon=True)
+        self.thread.start()
+
+    def submit(self, snapshot: dict):
+        if self.error is not None:
+            raise RuntimeError("Metrics writer thread failed") from self.error
+        with self.cond:
+            self.pending = snapshot
+            self.cond.notify()
+
+    def close(self):
+        """
+        Writes the pending snapshot, if any, and stops the thread
+        """
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError("Metrics writer thread failed") from self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        try:
+            while True:
+                with self.cond:
+                    while self.pending is None and not self.stopping:
+                        self.cond.wait()
+                    snapshot, self.pending = self.pending, None
+                    stopping = self.stopping
+                if snapshot is not None:
+                    write_json(self.path, snapshot)
+                    self.written += 1
+                if stopping and self.pending is None:
+                    return
+        except Exception as e:
+            self.error = e
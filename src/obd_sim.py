@@ -0,0 +1,78 @@
+import math
+import random
+import time
+import obd
+from obd.protocols import ECU
+from obd.protocols.protocol import Message
+from typing import Callable, Dict
+
+# Encoders from a physical value back to the mode 01 data bytes, i.e. the inverse of python-obd's decoders
+def _u8(v: float) -> bytes:
+    return bytes([min(max(int(round(v)), 0), 255)])
+
+def _u16(v: float) -> bytes:
+    v = min(max(int(round(v)), 0), 0xFFFF)
+    return bytes([v >> 8, v & 0xFF])
+
+PID_ENCODERS = {
+    "RPM":                  lambda v: _u16(v * 4),
+    "SPEED":                lambda v: _u8(v),
+    "MAF":                  lambda v: _u16(v * 100),
+    "THROTTLE_POS":         lambda v: _u8(v * 255 / 100),
+    "ENGINE_LOAD":          lambda v: _u8(v * 255 / 100),
+    "COOLANT_TEMP":         lambda v: _u8(v + 40),
+    "SHORT_FUEL_TRIM_1":    lambda v: _u8(v * 128 / 100 + 128),
+    "LONG_FUEL_TRIM_1":     lambda v: _u8(v * 128 / 100 + 128),
+    "TIMING_ADVANCE":       lambda v: _u8((v + 64) * 2),
+    "INTAKE_TEMP":          lambda v: _u8(v + 40),
+}
+
+# Physical value of each PID at t seconds into the simulated drive
+DEFAULT_SIGNALS = {
+    "RPM":                  lambda t: 1800 + 1000 * math.sin(t / 7),
+    "SPEED":                lambda t: 50 + 40 * math.sin(t / 23),
+    "MAF":                  lambda t: 12 + 9 * math.sin(t / 7),
+    "THROTTLE_POS":         lambda t: 25 + 20 * math.sin(t / 5),
+    "ENGINE_LOAD":          lambda t: 40 + 30 * math.sin(t / 6),
+    "COOLANT_TEMP":         lambda t: 20 + 65 * (1 - math.exp(-t / 120)),
+    "SHORT_FUEL_TRIM_1":    lambda t: 3 * math.sin(t / 3),
+    "LONG_FUEL_TRIM_1":     lambda t: 2.5,
+    "TIMING_ADVANCE":       lambda t: 15 + 10 * math.sin(t / 11),
+    "INTAKE_TEMP":          lambda t: 25 + 10 * (1 - math.exp(-t / 300)),
+}
+
+
+class SimulatedOBD:
+    """
+    Stand-in for obd.OBD that answers the mode 01 PIDs get_drive_stats polls, the way an ELM327
+    on a serial link would: each query blocks for the round-trip latency of the link, and the reply
+    bytes go through the command's own python-obd decoder. Used to exercise the polling code off the truck.
+    """
+    def __init__(self, *, latency: float = 0.03, latencies: Dict[str, float] = None,
+                 signals: Dict[str, Callable[[float], float]] = None, null_rate: float = 0.0, seed=None):
+        self.latency = latency
+        self.latencies = latencies or dict()
+        self.signals = dict(DEFAULT_SIGNALS, **(signals or dict()))
+        self.null_rate = null_rate
+        self.rng = random.Random(seed)
+        self.start = time.time()
+        self.n_queries = dict()
+
+    def is_connected(self) -> bool:
+        return True
+
+    def query(self, cmd: obd.OBDCommand, force: bool = False) -> obd.OBDResponse:
+        time.sleep(self.latencies.get(cmd.name, self.latency))
+        self.n_queries[cmd.name] = self.n_queries.get(cmd.name, 0) + 1
+
+        if cmd.name not in PID_ENCODERS or self.rng.random() < self.null_rate:
+            # no data - same as an ELM327 answering "NO DATA"
+            return obd.OBDResponse(cmd)
+
+        value = self.signals[cmd.name](time.time() - self.start)
+        message = Message([])
+        message.ecu = ECU.ENGINE
+        # echo of the mode and PID bytes ("010C" -> 01 0C), then the data bytes
+        message.data = bytearray.fromhex(cmd.command.decode()) + PID_ENCODERS[cmd.name](value)
+        message.data[0] += 0x40 # positive response to mode 01
+        return cmd([message])
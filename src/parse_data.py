@@ -1,9 +1,11 @@
 
 
-import csv
+import os
 import pint
+import numpy as np
 from enum import Enum
 from dataclasses import dataclass, field
+from typing import Dict, List
 
 # CSV line format
 # t_rpm, RPM, t_speed, speed, t_maf, maf, t_tps, tps, t_eload, eload, t_ctemp, ctemp, t_sftrim, sftrim, t_lftrim, lftrim, t_tadv, tadv, t_intmp, intmp
@@ -74,63 +76,213 @@ def parse_row(row: list):
     return parsed
 
 
+@dataclass(frozen=True)
+class SensorFrame:
+    """
+    Column-oriented drive data: one time array and one value array per sensor.
+    Units come from SENSOR_MAP and are attached per column, not per reading.
+    """
+    times:  Dict[SensorType, np.ndarray]
+    values: Dict[SensorType, np.ndarray]
+    units:  Dict[SensorType, pint.Unit] = field(default_factory=lambda: dict(SENSOR_MAP))
+
+    def __len__(self) -> int:
+        return len(self.times[SensorType.RPM])
+
+    def quantity(self, sensor: SensorType) -> pint.Quantity:
+        return pint.Quantity(self.values[sensor], self.units[sensor])
+
+    def readings(self, i: int) -> List[SensorReading]:
+        """
+        Row i as SensorReading objects, in the same form parse_row returns
+        """
+        return [
+            SensorReading(
+                sensor.value,
+                float(self.times[sensor][i]),
+                pint.Quantity(float(self.values[sensor][i]), self.units[sensor])
+            )
+            for sensor in SensorType
+        ]
+
+
+def parse_array(data) -> SensorFrame:
+    """
+    Builds a SensorFrame from an (n_rows, 20) array laid out like the CSV lines
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim != 2 or data.shape[1] != 2 * len(SensorType):
+        raise ValueError(f"Argument 'data' must have shape (n, {2 * len(SensorType)}) (got {data.shape})")
+
+    # one transposing copy makes every column contiguous
+    columns = np.ascontiguousarray(data.T)
+    return SensorFrame(
+        times={sensor: columns[2 * sensor.value] for sensor in SensorType},
+        values={sensor: columns[2 * sensor.value + 1] for sensor in SensorType},
+    )
+
+
+def parse_rows(rows) -> SensorFrame:
+    """
+    Bulk version of parse_row for an iterable of CSV rows
+    """
+    data = np.array(rows, dtype=np.float64)
+    if data.size == 0:
+        data = data.reshape(0, 2 * len(SensorType))
+    return parse_array(data)
+
+
+def parse_csv(path: os.PathLike) -> SensorFrame:
+    """
+    Parses a whole drive CSV straight into a SensorFrame
+    """
+    data = np.loadtxt(path, delimiter=",", dtype=np.float64, ndmin=2)
+    if data.size == 0:
+        data = data.reshape(0, 2 * len(SensorType))
+    return parse_array(data)
+
+
+def _finite_xy(x, y):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.shape != y.shape or x.ndim != 1:
+        raise ValueError(f"Arguments 'x' and 'y' must be 1D arrays of the same length (got {x.shape} and {y.shape})")
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+    return x, y
+
+
+def lttb(x, y, n_out: int):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a time series to n_out points. Keeps the first
+    and last points, then from each bucket the point making the largest triangle with the point
+    kept from the previous bucket and the mean of the next one, so peaks and shape survive.
+    Non-finite points are dropped. Returns the (x, y) arrays of the kept points.
+    """
+    if n_out < 3:
+        raise ValueError(f"Argument 'n_out' (got {n_out}) must be at least 3")
+    x, y = _finite_xy(x, y)
+    n = len(x)
+    if n <= n_out:
+        return x, y
+
+    # n_out - 2 buckets over the points between the first and the last
+    edges = (np.linspace(1, n - 1, n_out - 1)).astype(np.intp)
+    kept = np.empty(n_out, dtype=np.intp)
+    kept[0] = 0
+    kept[-1] = n - 1
+    prev = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        next_lo, next_hi = hi, edges[b + 2] if b + 2 < len(edges) else n
+        next_x = x[next_lo:next_hi].mean()
+        next_y = y[next_lo:next_hi].mean()
+        # twice the triangle area, the constant factor doesn't change the argmax
+        area = np.abs((x[prev] - next_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (next_y - y[prev]))
+        prev = lo + int(area.argmax())
+        kept[b + 1] = prev
+    return x[kept], y[kept]
+
+
+def minmax_decimate(x, y, n_out: int):
+    """
+    Keeps the minimum and maximum of each of n_out // 2 equal-count buckets, in time order.
+    Cheaper than lttb and never loses an extreme, at the cost of a more jagged line.
+    Non-finite points are dropped. Returns the (x, y) arrays of the kept points.
+    """
+    if n_out < 2:
+        raise ValueError(f"Argument 'n_out' (got {n_out}) must be at least 2")
+    x, y = _finite_xy(x, y)
+    n = len(x)
+    if n <= n_out:
+        return x, y
+
+    bucket = np.arange(n) * (n_out // 2) // n
+    # sorting by (bucket, y) puts each bucket's min first and its max last
+    order = np.lexsort((y, bucket))
+    starts = np.flatnonzero(np.r_[True, bucket[order][1:] != bucket[order][:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    kept = np.unique(np.concatenate((order[starts], order[ends])))
+    return x[kept], y[kept]
+
+
+DOWNSAMPLERS = {
+    "lttb":     lttb,
+    "minmax":   minmax_decimate,
+}
+
+
+def downsample(frame: SensorFrame, n_out: int, *, method: str = "lttb", sensors=None) -> Dict[SensorType, tuple]:
+    """
+    Downsamples each sensor of a SensorFrame to at most n_out points for plotting.
+    Returns {sensor: (times, values)} for the given sensors, all of them by default.
+    """
+    if method not in DOWNSAMPLERS:
+        raise ValueError(f"Unknown downsampling method '{method}', expected one of {list(DOWNSAMPLERS)}")
+    fn = DOWNSAMPLERS[method]
+    sensors = list(SensorType) if sensors is None else list(sensors)
+    return {sensor: fn(frame.times[sensor], frame.values[sensor], n_out) for sensor in sensors}
+
+
 # Load data from CSV
 if __name__ == "__main__":
+    import argparse
     import sys
-    import pandas as pd
-    import plotly.express as px
     from pathlib import Path
-    if len(sys.argv) < 2:
-        raise RuntimeError(f"Provide an argument for the CSV file to be read: python {__file__} <csv file path>")
-    elif len(sys.argv) == 2:
-        CSV_FILE = Path(sys.argv[-1])
-    elif sys.argv[0] == "-c" and len(sys.argv) < 3:
-        raise RuntimeError(f"Provide an argument for the CSV file to be read: python -c {__file__} <csv file path>")
-    else:
-        CSV_FILE = Path(sys.argv[2])
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
 
-    sensor_data = []
+    parser = argparse.ArgumentParser(
+            prog="parse_data",
+            description="Plots the sensors of a drive CSV, drive log or event log",
+    )
+    parser.add_argument("path", help="drive CSV, .dlog or .elog file")
+    parser.add_argument("--sensors", nargs="+", choices=[sensor.name for sensor in SensorType],
+                        default=[sensor.name for sensor in SensorType], help="sensors to plot, all by default")
+    parser.add_argument("--max-points", type=int, default=2000,
+                        help="points per sensor after downsampling, 0 plots every sample")
+    parser.add_argument("--method", choices=list(DOWNSAMPLERS), default="lttb")
+    args = parser.parse_args()
 
+    CSV_FILE = Path(args.path)
     if not CSV_FILE.is_file():
         raise RuntimeError(f"File '{str(CSV_FILE)}' is not a file")
 
-    with CSV_FILE.open("r", newline="") as logfile:
-        reader = csv.reader(logfile, delimiter=",")
-        for row in reader:
-            sensor_data.append(parse_row(row))
-
-    rpm_starttime = sensor_data[0][0].time
-    rpm_dataframe = pd.DataFrame({
-            "time": [reading[0].time - rpm_starttime for reading in sensor_data],
-            "rpm":  [reading[0].value.magnitude for reading in sensor_data]
-    })
-    speed_starttime = sensor_data[0][0].time
-    speed_dataframe = pd.DataFrame({
-            "time": [reading[1].time - speed_starttime for reading in sensor_data],
-            "speed": [reading[1].value.magnitude for reading in sensor_data]
-    })
-
-    series = [
-        (rpm_dataframe, "rpm"),
-        (speed_dataframe, "speed")
-    ]
+    if CSV_FILE.suffix == ".dlog":
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+        from src.drive_log import open_drive_log
+        _, rows = open_drive_log(CSV_FILE)
+        sensor_data = parse_array(rows)
+    elif CSV_FILE.suffix == ".elog":
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+        from src.drive_log import load_event_log
+        sensor_data = parse_array(load_event_log(CSV_FILE).to_numpy())
+    else:
+        sensor_data = parse_csv(CSV_FILE)
 
-    import plotly.graph_objects as go
-    #fig = px.line(rpm_dataframe, x="time", y="rpm")
-    #fig.update_traces(type="scatter", line_shape="spline")
-    fig = go.Figure()
-    for df, y_col in series:
-        fig.add_trace(go.Scatter(
-            x=df["time"],
-            y=df[y_col],
-            mode="lines+markers",
-            line_shape="spline",
-            line_smoothing=1.3
-        ))
+    if len(sensor_data) == 0:
+        raise RuntimeError(f"File '{str(CSV_FILE)}' has no rows")
+
+    sensors = [SensorType[name] for name in args.sensors]
+    if args.max_points > 0:
+        series = downsample(sensor_data, args.max_points, method=args.method, sensors=sensors)
+    else:
+        series = {sensor: (sensor_data.times[sensor], sensor_data.values[sensor]) for sensor in sensors}
+
+    starttime = np.nanmin(sensor_data.times[SensorType.RPM])
+    fig = make_subplots(
+        rows=len(sensors), cols=1, shared_xaxes=True, vertical_spacing=0.02,
+        subplot_titles=[f"{sensor.name} ({sensor_data.units[sensor]:~})" for sensor in sensors]
+    )
+    for row, (sensor, (t, v)) in enumerate(series.items(), start=1):
+        # WebGL lines, markers and spline smoothing don't scale to hour-long drives
+        fig.add_trace(go.Scattergl(x=t - starttime, y=v, mode="lines", name=sensor.name), row=row, col=1)
     fig.update_layout(
-        hovermode="x unified"
+        hovermode="x unified",
+        height=max(400, 180 * len(sensors)),
+        showlegend=False
     )
+    fig.update_xaxes(title_text="time (s)", row=len(sensors), col=1)
 
     fig.show()
-    
-
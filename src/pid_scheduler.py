@@ -0,0 +1,118 @@
+import time
+import obd
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Union
+
+
+@dataclass
+class PIDSchedule:
+    """
+    How often to poll a PID. interval is the target time between queries in seconds (0 polls it
+    every cycle), or a function of the scheduler returning it, for PIDs whose rate depends on
+    other readings. When a cycle's query budget (PIDScheduler's max_queries) runs out, due PIDs are
+    ranked by how overdue they are, weighted by (priority + 1), so higher priorities win without
+    starving the rest. Without a budget every due PID is queried and priority only sets the order.
+    """
+    command:    obd.OBDCommand
+    interval:   Union[float, Callable[["PIDScheduler"], float]] = 0.0
+    priority:   int = 0
+
+
+class PIDScheduler:
+    """
+    Polls a set of PIDs at their own target rates. Each poll() is one cycle: the PIDs that are due
+    are queried back to back, in priority order, and the rest are served from the last response
+    actually received for them (with that response's original timestamp). A PID polled every cycle
+    (interval 0) that doesn't answer, or that didn't fit in the max_queries budget, is served as null
+    with the time of the cycle instead, since re-serving the old response would log a repeated
+    timestamp and a zero time step.
+    With an obd_metrics.PollMetrics, query latencies, nulls, cache hits and cycle times are recorded.
+    """
+    def __init__(self, obd_conn, schedules: Sequence[PIDSchedule], *, max_queries: Optional[int] = None,
+                 clock: Callable[[], float] = time.monotonic, metrics=None):
+        if max_queries is not None and max_queries <= 0:
+            raise ValueError(f"Argument 'max_queries' (got {max_queries}) cannot be negative or 0!")
+        self.obd_conn = obd_conn
+        self.schedules = list(schedules)
+        self.max_queries = max_queries
+        self.clock = clock
+        self.metrics = metrics
+        self.responses = dict()   # command name -> last response received
+        self.queried_at = dict()  # command name -> clock time of the last query
+        self.queried = set()      # command names queried in the last cycle
+        self.skipped = set()      # command names served as null in the last cycle for lack of budget
+
+    def value(self, command: obd.OBDCommand) -> Optional[float]:
+        """
+        Magnitude of the last non-null response for a command, None if there isn't one
+        """
+        r = self.responses.get(command.name)
+        if r is None or r.value is None:
+            return None
+        return r.value.magnitude
+
+    def in_range(self, command: obd.OBDCommand, lower: float, upper: float) -> bool:
+        v = self.value(command)
+        return v is not None and lower <= v <= upper
+
+    def interval(self, schedule: PIDSchedule) -> float:
+        return schedule.interval(self) if callable(schedule.interval) else schedule.interval
+
+    def due(self, now: float) -> List[PIDSchedule]:
+        """
+        Schedules due for a query at time now, most (priority weighted) overdue first
+        """
+        due = []
+        for s in self.schedules:
+            last = self.queried_at.get(s.command.name)
+            if last is None:
+                due.append((s, float("inf")))
+                continue
+            overdue = now - last - self.interval(s)
+            if overdue >= 0:
+                due.append((s, overdue))
+        due.sort(key=lambda item: -(item[0].priority + 1) * item[1])
+        return [s for s, _ in due]
+
+    def query(self, schedule: PIDSchedule) -> obd.OBDResponse:
+        start = self.clock()
+        r = self.obd_conn.query(schedule.command)
+        end = self.clock()
+        self.queried_at[schedule.command.name] = end
+        if self.metrics is not None:
+            self.metrics.record_query(schedule.command.name, end - start, r.is_null())
+        self.queried.add(schedule.command.name)
+        # keep serving the last good value if the PID didn't answer this time, unless it's
+        # polled every cycle, where that would repeat the old timestamp
+        if not r.is_null() or schedule.command.name not in self.responses or self.interval(schedule) == 0:
+            self.responses[schedule.command.name] = r
+        return r
+
+    def poll(self) -> List[obd.OBDResponse]:
+        """
+        Runs one cycle, returning the latest response for every schedule, in schedule order
+        """
+        self.queried = set()
+        self.skipped = set()
+        start = self.clock()
+        due = self.due(start)
+        if self.max_queries is not None:
+            due = due[:self.max_queries]
+            # PIDs that have never answered can't be served from the cache
+            due += [s for s in self.schedules if s.command.name not in self.responses and s not in due]
+        for s in due:
+            self.query(s)
+        for s in self.schedules:
+            if s.command.name in self.queried:
+                continue
+            if self.interval(s) == 0:
+                # due every cycle but over budget: not read this cycle, same as a null reply
+                self.responses[s.command.name] = obd.OBDResponse(s.command)
+                self.skipped.add(s.command.name)
+                if self.metrics is not None:
+                    self.metrics.record_skip(s.command.name)
+            elif self.metrics is not None:
+                self.metrics.record_cache_hit(s.command.name)
+        if self.metrics is not None:
+            self.metrics.record_cycle(self.clock() - start)
+        return [self.responses[s.command.name] for s in self.schedules]
@@ -0,0 +1,181 @@
+import math
+from collections import deque
+from typing import Dict, Sequence
+
+from .make_features import KNOWN_COL_NAMES, FEATURE_SPEC
+
+# Derived columns in the order get_data_from_csv builds them: (name, source column)
+# Each one is source.diff() / time_diff, where time_diff comes from rpm_time, and NaN where that is +-inf
+DERIVED_COLS = [
+        ("rpm_accel", "rpm_value"),
+        ("rpm_jerk", "rpm_accel"),
+        ("speed_accel", "speed_value"),
+        ("speed_jerk", "speed_accel"),
+        ("maf_accel", "maf_value"),
+        ("throttle_rate", "throttle_value"),
+]
+
+
+def _div(num: float, den: float) -> float:
+    """
+    Float division with the same inf/nan results pandas gives for a zero denominator
+    """
+    if den == 0 or math.isnan(den):
+        if num == 0 or math.isnan(num) or math.isnan(den):
+            return math.nan
+        return math.copysign(math.inf, num) * math.copysign(1.0, den)
+    return num / den
+
+
+class RollingMoments:
+    """
+    Sliding window mean/std using Welford's update and its inverse for the sample
+    leaving the window. NaNs and infs take up a slot in the window but are skipped, like pandas;
+    one inf through the update would leave the mean NaN for good. Like pandas, a window of one
+    repeated value gives exactly that mean and a std of 0, and the sums are recomputed from the
+    window every window_sz samples so rounding errors can't pile up over a long drive.
+    """
+    def __init__(self, window_sz: int):
+        self.window = deque(maxlen=window_sz)
+        self.n = 0
+        self.mean_ = 0.0
+        self.m2 = 0.0
+        self.last = math.nan
+        self.run = 0 # trailing run of finite samples equal to last
+        self.since_recompute = 0
+
+    def update(self, x: float):
+        if len(self.window) == self.window.maxlen:
+            self._remove(self.window[0])
+        self.window.append(x)
+        self.since_recompute += 1
+        if self.since_recompute >= self.window.maxlen:
+            self._recompute()
+        elif math.isfinite(x):
+            self.n += 1
+            delta = x - self.mean_
+            self.mean_ += delta / self.n
+            self.m2 += delta * (x - self.mean_)
+        if not math.isfinite(x):
+            return
+        self.run = self.run + 1 if x == self.last else 1
+        self.last = x
+
+    def _remove(self, x: float):
+        if not math.isfinite(x):
+            return
+        if self.n == 1:
+            self.n = 0
+            self.mean_ = 0.0
+            self.m2 = 0.0
+            return
+        self.n -= 1
+        delta = x - self.mean_
+        self.mean_ -= delta / self.n
+        self.m2 = max(self.m2 - delta * (x - self.mean_), 0.0)
+
+    def _recompute(self):
+        values = [x for x in self.window if math.isfinite(x)]
+        self.since_recompute = 0
+        self.n = len(values)
+        self.mean_ = math.fsum(values) / self.n if values else 0.0
+        self.m2 = math.fsum((x - self.mean_) ** 2 for x in values)
+
+    def mean(self) -> float:
+        if self.n == 0:
+            return math.nan
+        return self.last if self.run >= self.n else self.mean_
+
+    def std(self) -> float:
+        if self.n < 2:
+            return math.nan
+        return 0.0 if self.run >= self.n else math.sqrt(self.m2 / (self.n - 1))
+
+
+class RollingExtreme:
+    """
+    Sliding window min or max using a monotonic deque of (sample index, value), skipping NaNs and infs
+    """
+    def __init__(self, window_sz: int, largest: bool):
+        self.window_sz = window_sz
+        self.largest = largest
+        self.candidates = deque()
+        self.i = -1
+
+    def update(self, x: float):
+        self.i += 1
+        while self.candidates and self.candidates[0][0] <= self.i - self.window_sz:
+            self.candidates.popleft()
+        if not math.isfinite(x):
+            return
+        if self.largest:
+            while self.candidates and self.candidates[-1][1] <= x:
+                self.candidates.pop()
+        else:
+            while self.candidates and self.candidates[-1][1] >= x:
+                self.candidates.pop()
+        self.candidates.append((self.i, x))
+
+    def value(self) -> float:
+        return self.candidates[0][1] if self.candidates else math.nan
+
+
+class StreamingFeatureExtractor:
+    """
+    Computes the make_features_clustering feature vector one poll_obd row at a time,
+    with constant memory per sample. update() returns the features of the window
+    ending at the given row, matching the batch path row for row.
+    """
+    def __init__(self, window_sz: int = 20):
+        if window_sz < 1:
+            raise ValueError(f"Argument 'window_sz' (got {window_sz}) must be 1 or larger")
+        self.window_sz = window_sz
+        self.reset()
+
+    def reset(self):
+        self.prev = None
+        self.moments = dict()
+        self.extremes = dict()
+        for _, col, agg in FEATURE_SPEC:
+            if agg in ("std", "mean"):
+                if col not in self.moments:
+                    self.moments[col] = RollingMoments(self.window_sz)
+            else:
+                key = (col, agg)
+                if key not in self.extremes:
+                    self.extremes[key] = RollingExtreme(self.window_sz, largest=(agg != "min"))
+
+    def update(self, row: Sequence[float]) -> Dict[str, float]:
+        if len(row) != len(KNOWN_COL_NAMES):
+            raise ValueError(f"Argument 'row' must have {len(KNOWN_COL_NAMES)} values (got {len(row)})")
+
+        cur = {name: float(v) for name, v in zip(KNOWN_COL_NAMES, row)}
+        prev = self.prev
+        time_diff = cur["rpm_time"] - prev["rpm_time"] if prev is not None else math.nan
+        for name, source in DERIVED_COLS:
+            diff = cur[source] - prev[source] if prev is not None else math.nan
+            rate = _div(diff, time_diff)
+            cur[name] = rate if not math.isinf(rate) else math.nan
+        self.prev = cur
+
+        for col, stats in self.moments.items():
+            stats.update(cur[col])
+        for (col, agg), stats in self.extremes.items():
+            stats.update(abs(cur[col]) if agg == "max_abs" else cur[col])
+
+        return self.features()
+
+    def features(self) -> Dict[str, float]:
+        """
+        Feature vector of the current window, keyed in make_features_clustering column order
+        """
+        row = dict()
+        for name, col, agg in FEATURE_SPEC:
+            if agg == "std":
+                row[name] = self.moments[col].std()
+            elif agg == "mean":
+                row[name] = self.moments[col].mean()
+            else:
+                row[name] = self.extremes[(col, agg)].value()
+        return row
+
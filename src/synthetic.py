@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Sequence, Tuple
+
+from .make_features import KNOWN_COL_NAMES, SENSOR_NAMES
+from .drive_log import DRIVE_LOG_SUFFIX, DriveLogWriter
+
+# Per segment type: (target speed range in kph, seconds between target changes, max accel, max decel in kph/s)
+SEGMENT_TYPES = {
+    "idle":         ((0, 0), 30.0, 1.0, 3.0),
+    "city":         ((0, 55), 12.0, 2.5, 4.0),
+    "highway":      ((90, 115), 40.0, 1.0, 1.5),
+    "hard_accel":   ((0, 110), 8.0, 9.0, 9.0),
+}
+
+DEFAULT_SEGMENTS = (("idle", 60), ("city", 600), ("highway", 900), ("hard_accel", 60), ("city", 300), ("idle", 30))
+
+# kph at which each gear tops out, and the rpm per kph in it
+GEAR_SHIFT_KPH = np.array([20, 40, 65, 90, np.inf])
+GEAR_RPM_PER_KPH = np.array([110, 65, 42, 30, 24])
+IDLE_RPM = 750.0
+
+# Delay between the queries of consecutive PIDs in a poll, so each sensor gets its own timestamps
+PID_QUERY_DELAY = 0.03
+
+
+def _speed_profile(segments: Sequence[Tuple[str, float]], rate: float, rng: np.random.Generator) -> np.ndarray:
+    speeds = []
+    speed = 0.0
+    dt = 1.0 / rate
+    for kind, seconds in segments:
+        if kind not in SEGMENT_TYPES:
+            raise ValueError(f"Unknown segment type '{kind}', expected one of {list(SEGMENT_TYPES)}")
+        (lo, hi), hold, accel, decel = SEGMENT_TYPES[kind]
+        n = int(seconds * rate)
+        # piecewise constant target speed that the vehicle chases within its accel limits
+        n_targets = max(1, int(np.ceil(seconds / hold)))
+        targets = rng.uniform(lo, hi, n_targets)
+        if kind == "hard_accel":
+            targets[::2] = 0.0
+        if kind == "city":
+            targets[rng.random(n_targets) < 0.3] = 0.0 # stop lights
+        target = np.repeat(targets, int(np.ceil(n / n_targets)))[:n]
+        seg = np.empty(n)
+        for i in range(n):
+            speed += np.clip(target[i] - speed, -decel * dt, accel * dt)
+            seg[i] = speed
+        speeds.append(seg)
+    return np.concatenate(speeds) if speeds else np.empty(0)
+
+
+def make_synthetic_drive(segments: Sequence[Tuple[str, float]] = DEFAULT_SEGMENTS, *, rate: float = 10.0,
+                         t0: float = 1.7e9, seed=None) -> pd.DataFrame:
+    """
+    Makes a drive in the KNOWN_COL_NAMES layout from (segment type, seconds) pairs, sampled at rate
+    polls per second. Segment types are the keys of SEGMENT_TYPES.
+    """
+    if rate <= 0:
+        raise ValueError(f"Argument 'rate' (got {rate}) cannot be negative or 0!")
+    rng = np.random.default_rng(seed)
+
+    speed = _speed_profile(segments, rate, rng)
+    n = len(speed)
+    t = t0 + np.arange(n) / rate
+    accel = np.gradient(speed, 1.0 / rate) if n > 1 else np.zeros(n)
+
+    gear = np.searchsorted(GEAR_SHIFT_KPH, speed)
+    rpm = np.maximum(IDLE_RPM, speed * GEAR_RPM_PER_KPH[gear]) + rng.normal(0, 15, n)
+    throttle = np.clip(12 + 6 * np.maximum(accel, 0) + 0.08 * speed + rng.normal(0, 1, n), 0, 100)
+    engine_load = np.clip(20 + 0.6 * throttle + 2 * np.maximum(accel, 0) + rng.normal(0, 2, n), 0, 100)
+    maf = np.maximum(1.5, rpm * engine_load / 4500 + rng.normal(0, 0.3, n))
+    elapsed = t - t0
+    coolant = np.round(85 - 65 * np.exp(-elapsed / 240))
+    s_fuel_trim = np.round(rng.normal(0, 2.5, n) * 1.28) / 1.28
+    l_fuel_trim = np.full(n, 2.34375)
+    timing_advance = np.clip(30 - 0.2 * engine_load + rng.normal(0, 1, n), -10, 45)
+    intake_temp = np.round(25 + 12 * (1 - np.exp(-elapsed / 600)) - 0.03 * speed)
+
+    values = [rpm, speed, maf, throttle, engine_load, coolant, s_fuel_trim, l_fuel_trim, timing_advance, intake_temp]
+    drive = dict()
+    for i, (name, v) in enumerate(zip(SENSOR_NAMES, values)):
+        drive[f"{name}_time"] = t + i * PID_QUERY_DELAY
+        drive[f"{name}_value"] = v
+    return pd.DataFrame(drive, columns=KNOWN_COL_NAMES)
+
+
+def write_synthetic_drive(path: os.PathLike, segments: Sequence[Tuple[str, float]] = DEFAULT_SEGMENTS, **kwargs) -> Path:
+    """
+    Writes make_synthetic_drive output as a drive CSV, or as a drive log if path has its suffix
+    """
+    path = Path(path)
+    drive = make_synthetic_drive(segments, **kwargs)
+    if path.suffix == DRIVE_LOG_SUFFIX:
+        with DriveLogWriter(path) as writer:
+            writer.append_rows(drive.to_numpy())
+    else:
+        drive.to_csv(path, header=False, index=False)
+    return path